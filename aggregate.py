@@ -0,0 +1,43 @@
+import numpy as np
+
+from segments import AMOUNT_SPLIT
+
+
+def grouped_units(group_codes, units_hi, units_lo, n_groups: int):
+    """Exact base-unit total per group code, as a list indexed by code.
+
+    The halves of the split amounts are summed separately in int64, where
+    bincount weights would round through float64. Should the high halves be
+    large enough for a sum to overflow, the totals are added up as Python ints.
+    """
+    units_hi, units_lo = np.asarray(units_hi), np.asarray(units_lo)
+    if len(units_hi) and int(units_hi.max()) > np.iinfo(np.int64).max // len(units_hi):
+        totals = [0] * n_groups
+        for code, hi, lo in zip(group_codes.tolist(), units_hi.tolist(), units_lo.tolist()):
+            totals[code] += hi * AMOUNT_SPLIT + lo
+        return totals
+    hi = np.zeros(n_groups, dtype=np.int64)
+    lo = np.zeros(n_groups, dtype=np.int64)
+    np.add.at(hi, group_codes, units_hi)
+    np.add.at(lo, group_codes, units_lo)
+    return [h * AMOUNT_SPLIT + l for h, l in zip(hi.tolist(), lo.tolist())]
+
+
+def buyer_token_totals(segment):
+    """Base-unit total per buyer and token of a segment: {buyer: {token: units}}.
+
+    Reads only the code and amount arrays, so no row is decoded. Nothing
+    returned refers to the mapping, and the segment can be closed right after.
+    """
+    symbols = segment.footer["token_symbols"]
+    n_buyers, n_tokens = segment.footer["buyers"], max(len(symbols), 1)
+    group_codes = np.asarray(segment.buyer_codes(), dtype=np.intp) * n_tokens + np.asarray(segment.token_codes())
+    units_hi, units_lo = segment.units()
+    totals = grouped_units(group_codes, units_hi, units_lo, n_buyers * n_tokens)
+    del units_hi, units_lo
+
+    buyers = segment.values("buyers", range(n_buyers))
+    result = {}
+    for group in np.flatnonzero(np.bincount(group_codes, minlength=n_buyers * n_tokens)).tolist():
+        result.setdefault(buyers[group // n_tokens], {})[symbols[group % n_tokens]] = totals[group]
+    return result
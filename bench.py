@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+
+import aggregate
+import lords_unique
+import segments
+import tracker
+from sales import page_decoder
+
+
+async def bench_query(args):
+    """Compare response size and decode time of the lean and full selections.
+
+    Needs the marketplace API keys in the environment; every collection is
+    fetched with the same page window twice, once per selection.
+    """
+    async with aiohttp.ClientSession() as session:
+        print(f"{'collection':<10} {'selection':<9} {'request B':>10} {'response B':>11} {'decode ms':>10}")
+        for name, collection in tracker.COLLECTIONS.items():
+            for include_metadata in (True, False):
+                payload = {
+                    "query": tracker.build_query(name, include_metadata),
+                    "variables": {
+                        "tokenAddress": collection["token_address"],
+                        "size": args.size,
+                        "offset": args.offset
+                    }
+                }
+                label, secret = await tracker.KEY_POOL.acquire()
+                status = None
+                try:
+                    headers = {"Content-Type": "application/json", "X-API-Key": secret}
+                    async with session.post(tracker.API_URL, headers=headers, json=payload) as response:
+                        status = response.status
+                        body = await response.read()
+                finally:
+                    tracker.KEY_POOL.release(label, status)
+
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    json.loads(body)
+                decode_ms = (time.perf_counter() - started) * 1000 / args.repeat
+
+                selection = "full" if include_metadata else "lean"
+                request_bytes = len(json.dumps(payload).encode())
+                print(f"{name:<10} {selection:<9} {request_bytes:>10} {len(body):>11} {decode_ms:>10.3f}")
+
+
+def synthetic_page(size: int):
+    # Shaped like a recentlySolds page fetched with metadata, attributes and all.
+    results = []
+    for i in range(size):
+        results.append({
+            "maker": f"0x{i:040x}",
+            "matcher": f"0x{i + 1:040x}",
+            "paymentToken": "0xc99a6a985ed2cac1ef41640596c5a5f9f4e19ef5",
+            "realPrice": str(1500000000000000000 + i),
+            "timestamp": 1739192400 + i,
+            "txHash": f"0x{i:064x}",
+            "orderKind": 1,
+            "assets": [{
+                "id": str(1000 + i),
+                "token": {
+                    "numActiveOffers": 3,
+                    "name": f"Lord #{1000 + i}",
+                    "cdnImage": f"https://cdn.skymavis.com/ronin/2020/erc721/lords/{1000 + i}.png",
+                    "attributes": {f"trait_{t}": [f"value {t} of lord {i}"] for t in range(12)}
+                }
+            }]
+        })
+    return json.dumps({"data": {"recentlySolds": {"results": results}}}).encode()
+
+
+async def fetch_page_body(name: str, size: int, offset: int):
+    payload = {
+        "query": tracker.build_query(name, True),
+        "variables": {
+            "tokenAddress": tracker.COLLECTIONS[name]["token_address"],
+            "size": size,
+            "offset": offset
+        }
+    }
+    label, secret = await tracker.KEY_POOL.acquire()
+    status = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            headers = {"Content-Type": "application/json", "X-API-Key": secret}
+            async with session.post(tracker.API_URL, headers=headers, json=payload) as response:
+                status = response.status
+                return await response.read()
+    finally:
+        tracker.KEY_POOL.release(label, status)
+
+
+def decode_dicts(body: bytes):
+    data = json.loads(body)
+    results = data.get("data", {}).get("recentlySolds", {}).get("results", [])
+    return [(tx.get("timestamp", 0), tx.get("txHash"), [a.get("id") for a in tx.get("assets", [])]) for tx in results]
+
+
+def decode_structs(body: bytes):
+    results = page_decoder.decode(body).data.recentlySolds.results
+    return [(tx.timestamp, tx.txHash, [a.id for a in tx.assets]) for tx in results]
+
+
+def bench_decode(args):
+    """Decode time and peak allocation per page: json dicts vs sale structs."""
+    if args.file:
+        with open(args.file, 'rb') as f:
+            body = f.read()
+    elif args.synthetic:
+        body = synthetic_page(args.size)
+    else:
+        body = asyncio.run(fetch_page_body(args.collection, args.size, 0))
+
+    print(f"page: {len(body)} bytes")
+    print(f"{'decoder':<8} {'time us':>10} {'peak KiB':>10}")
+    for label, decode in (("dicts", decode_dicts), ("structs", decode_structs)):
+        decode(body)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            decode(body)
+        elapsed_us = (time.perf_counter() - started) * 1e6 / args.repeat
+
+        tracemalloc.start()
+        decode(body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<8} {elapsed_us:>10.1f} {peak / 1024:>10.1f}")
+
+
+def write_synthetic_week(filename: str, rows: int):
+    rng = random.Random(rows)
+    buyers = [f"0x{rng.getrandbits(160):040x}" for _ in range(max(rows // 20, 1))]
+    tokens = [("WETH", 18), ("WRON", 18), ("AXS", 18), ("USDC", 6)]
+    with open(filename, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(tracker.get_fieldnames("lords"))
+        for i in range(rows):
+            token, decimals = rng.choice(tokens)
+            real_price = rng.randrange(10 ** (decimals - 3), 10 ** (decimals + 2))
+            writer.writerow([
+                rng.choice(buyers), rng.randrange(1, 20000),
+                tracker.format_price(real_price / 10 ** decimals, token),
+                f"0x{rng.getrandbits(256):064x}", 1739192400 + i, real_price, token
+            ])
+
+
+def run_unique_update(buyers_filename: str, unique_filename: str):
+    lords_unique.get_current_buyers_filename = lambda: buyers_filename
+    lords_unique.get_current_unique_filename = lambda: unique_filename
+    lords_unique.reset_aggregate_state(None, None)
+    started = time.perf_counter()
+    lords_unique.update_unique_buyers()
+    return time.perf_counter() - started, lords_unique.aggregate_state["totals"]
+
+
+def segment_totals_by_row(segment):
+    # How a closed week was summed before the grouped reductions.
+    totals = {}
+    symbols = segment.footer["token_symbols"]
+    buyers = segment.values("buyers", range(segment.footer["buyers"]))
+    buyer_codes, token_codes = segment.buyer_codes(), segment.token_codes()
+    for i, units in enumerate(segment.values("realPrice", range(len(segment)))):
+        tokens = totals.setdefault(buyers[buyer_codes[i]], {})
+        token = symbols[token_codes[i]]
+        tokens[token] = tokens.get(token, 0) + int(units)
+    return totals
+
+
+def bench_aggregate(args):
+    """Recomputing a week's per-buyer totals: row by row vs grouped reductions.
+
+    "unique s" is update_unique_buyers over the week's CSV from scratch,
+    "rows s" a pass over the closed week's segment row by row, and
+    "grouped s" the reductions over its typed arrays.
+    """
+    print(f"{'rows':>9} {'unique s':>9} {'rows s':>9} {'grouped s':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            buyers_filename = os.path.join(directory, f"lords_buyers_{rows}.csv")
+            unique_filename = os.path.join(directory, f"lords_unique_{rows}.csv")
+            write_synthetic_week(buyers_filename, rows)
+            unique, expected = run_unique_update(buyers_filename, unique_filename)
+
+            with open(buyers_filename, newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                segments.write_segment(segments.segment_filename(buyers_filename), header, list(reader), lords_unique.TOKEN_DECIMALS)
+            segment = segments.Segment(segments.segment_filename(buyers_filename))
+
+            started = time.perf_counter()
+            by_row = segment_totals_by_row(segment)
+            by_row_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            grouped = aggregate.buyer_token_totals(segment)
+            grouped_s = time.perf_counter() - started
+            segment.close()
+
+            assert grouped == by_row == {buyer: dict(tokens) for buyer, tokens in expected.items()}, "totals differ"
+            print(f"{rows:>9} {unique:>9.3f} {by_row_s:>9.3f} {grouped_s:>10.3f}")
+
+
+async def measure_loop_lag(work):
+    """Largest gap between 1 ms ticks of the event loop while work runs."""
+    lag = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal lag
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - started - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await work()
+    running = False
+    await task
+    return lag
+
+
+async def bench_io(args):
+    """Event-loop stall while the live week's sorted view is rebuilt.
+
+    "inline" indexes the log and writes the view on the event loop; "pool"
+    does both on the IO pool the way serve_csv does. "lock ms" is how long
+    the pool path holds the log's lock, which is what an append waits for.
+    Both start cold, indexing the whole log; a running tracker only indexes
+    the rows appended since the last download.
+    """
+    print(f"{'rows':>9} {'inline lag ms':>14} {'pool lag ms':>12} {'lock ms':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            filename = os.path.join(directory, f"lords_buyers_{rows}.csv")
+            write_synthetic_week(filename, rows)
+            held = 0.0
+
+            def reset():
+                tracker._sorted_views.clear()
+                tracker._log_indexes.clear()
+
+            async def inline():
+                reset()
+                tracker.write_sorted_view(*tracker.snapshot_sorted_view(filename))
+
+            async def pooled():
+                nonlocal held
+                reset()
+                async with tracker.file_lock(filename):
+                    started = time.perf_counter()
+                    view = await tracker.run_io(tracker.snapshot_sorted_view, filename)
+                    held = time.perf_counter() - started
+                await tracker.run_io(tracker.write_sorted_view, *view)
+
+            inline_lag = await measure_loop_lag(inline)
+            pool_lag = await measure_loop_lag(pooled)
+            print(f"{rows:>9} {inline_lag * 1000:>14.1f} {pool_lag * 1000:>12.1f} {held * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the sales tracker.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="payload size of lean vs full GraphQL selections")
+    query.add_argument("--size", type=int, default=tracker.PAGE_SIZE)
+    query.add_argument("--offset", type=int, default=0)
+    query.add_argument("--repeat", type=int, default=50)
+
+    decode = commands.add_parser("decode", help="decode time and peak allocation per page")
+    decode.add_argument("--file", help="saved response body to decode instead of fetching one")
+    decode.add_argument("--synthetic", action="store_true", help="decode a generated page instead of fetching one")
+    decode.add_argument("--collection", default="lords", choices=list(tracker.COLLECTIONS))
+    decode.add_argument("--size", type=int, default=tracker.PAGE_SIZE)
+    decode.add_argument("--repeat", type=int, default=200)
+
+    aggregate_parser = commands.add_parser("aggregate", help="per-buyer week totals, row by row vs grouped reductions")
+    aggregate_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    io_parser = commands.add_parser("io", help="event-loop lag while a live CSV view is rebuilt")
+    io_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 500000])
+
+    args = parser.parse_args()
+    if args.command == "query":
+        asyncio.run(bench_query(args))
+    elif args.command == "decode":
+        bench_decode(args)
+    elif args.command == "aggregate":
+        bench_aggregate(args)
+    elif args.command == "io":
+        asyncio.run(bench_io(args))
+
+
+if __name__ == "__main__":
+    main()
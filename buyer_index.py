@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from array import array
+
+# Every buyer's sales across collections and weeks, so a profile is one
+# dictionary lookup whatever the number of weeks. Closed weeks are kept as
+# row numbers into their segments and persisted; the live week is kept as row
+# numbers into its log's LogIndex, added as pages are appended and rebuilt
+# from the log on start.
+BUYER_INDEX_FILE = os.getenv("BUYER_INDEX_FILE", "./buyer_index.json")
+
+
+class BuyerIndex:
+    """Buyer address (lowercase) -> sales and per-token totals per collection."""
+
+    def __init__(self, filename: str = BUYER_INDEX_FILE):
+        self.filename = filename
+        # {buyer: {(collection, week_start): array of segment row numbers}}
+        self.closed = {}
+        # {buyer: {collection: {token: units}}} over the closed weeks
+        self.closed_totals = {}
+        self.closed_weeks = set()
+        # {(collection, week_start): {"index": LogIndex, "rows": rows added,
+        #  "postings": {buyer: array of log row numbers}}}
+        self.live = {}
+        # {(collection, week_start): {buyer: {token: units}}} over the live weeks
+        self.live_totals = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        closed, closed_totals = {}, {}
+        for buyer, entry in data["buyers"].items():
+            closed[buyer] = {}
+            for week, rows in entry["rows"].items():
+                collection, week_start = week.split(":")
+                closed[buyer][(collection, int(week_start))] = array("I", rows)
+            closed_totals[buyer] = {
+                collection: {token: int(units) for token, units in tokens.items()}
+                for collection, tokens in entry["totals"].items()
+            }
+        with self.lock:
+            self.closed, self.closed_totals = closed, closed_totals
+            self.closed_weeks = {(week.split(":")[0], int(week.split(":")[1])) for week in data["weeks"]}
+        return True
+
+    def save(self):
+        with self.lock:
+            encoded = json.dumps({
+                "weeks": [f"{collection}:{week_start}" for collection, week_start in sorted(self.closed_weeks)],
+                "buyers": {
+                    buyer: {
+                        "rows": {f"{collection}:{week_start}": rows.tolist() for (collection, week_start), rows in weeks.items()},
+                        "totals": {
+                            collection: {token: str(units) for token, units in tokens.items()}
+                            for collection, tokens in self.closed_totals[buyer].items()
+                        }
+                    }
+                    for buyer, weeks in self.closed.items()
+                }
+            })
+        tmp_filename = f"{self.filename}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write(encoded)
+        os.replace(tmp_filename, self.filename)
+
+    def has_closed_week(self, collection: str, week_start: int):
+        return (collection, week_start) in self.closed_weeks
+
+    def add_segment(self, collection: str, week_start: int, segment):
+        """Index a closed week from its segment, replacing its live sales."""
+        symbols = segment.footer["token_symbols"]
+        token_codes = segment.token_codes()
+        with self.lock:
+            if (collection, week_start) in self.closed_weeks:
+                return False
+            # Segment postings are keyed on the lowercase address already.
+            for buyer, rows in segment.posting_items("buyer"):
+                self.closed.setdefault(buyer, {})[(collection, week_start)] = array("I", rows)
+                totals = self.closed_totals.setdefault(buyer, {}).setdefault(collection, {})
+                for row in rows:
+                    token = symbols[token_codes[row]]
+                    totals[token] = totals.get(token, 0) + segment.real_price(row)
+            self.closed_weeks.add((collection, week_start))
+            self.live.pop((collection, week_start), None)
+            self.live_totals.pop((collection, week_start), None)
+        return True
+
+    def drop_collection(self, collection: str):
+        """Forget a collection's closed weeks, so they can be added again.
+
+        Totals are kept per collection rather than per week, hence all of them.
+        """
+        with self.lock:
+            for buyer in list(self.closed):
+                weeks = self.closed[buyer]
+                for week in [week for week in weeks if week[0] == collection]:
+                    del weeks[week]
+                self.closed_totals[buyer].pop(collection, None)
+                if not weeks:
+                    del self.closed[buyer], self.closed_totals[buyer]
+            self.closed_weeks = {week for week in self.closed_weeks if week[0] != collection}
+
+    def add_log_rows(self, collection: str, week_start: int, index):
+        """Add the rows a refreshed LogIndex holds beyond those already added.
+
+        A log that was rewritten, and so indexed again from scratch, replaces
+        the week's rows.
+        """
+        with self.lock:
+            entry = self.live.get((collection, week_start))
+            if entry is None or entry["index"] is not index or entry["rows"] > len(index.timestamps):
+                entry = self.live[(collection, week_start)] = {"index": index, "rows": 0, "postings": {}}
+                self.live_totals[(collection, week_start)] = {}
+            postings, totals = entry["postings"], self.live_totals[(collection, week_start)]
+            for row in range(entry["rows"], len(index.timestamps)):
+                buyer = index.buyers[row].lower()
+                postings.setdefault(buyer, array("I")).append(row)
+                tokens = totals.setdefault(buyer, {})
+                tokens[index.tokens[row]] = tokens.get(index.tokens[row], 0) + index.real_prices[row]
+            entry["rows"] = len(index.timestamps)
+
+    def lookup(self, buyer: str):
+        """(closed {(collection, week_start): rows}, live [(collection, LogIndex, rows)], totals)."""
+        buyer = buyer.lower()
+        with self.lock:
+            closed = dict(self.closed.get(buyer, {}))
+            totals = {
+                collection: dict(tokens)
+                for collection, tokens in self.closed_totals.get(buyer, {}).items()
+            }
+            live = [
+                (collection, entry["index"], list(entry["postings"][buyer]))
+                for (collection, _), entry in self.live.items()
+                if buyer in entry["postings"]
+            ]
+            for (collection, _), buyers in self.live_totals.items():
+                for token, units in buyers.get(buyer, {}).items():
+                    tokens = totals.setdefault(collection, {})
+                    tokens[token] = tokens.get(token, 0) + units
+        return closed, live, totals
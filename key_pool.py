@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+
+class ApiKeyPool:
+    """Token-bucket rate limiter shared by every collection's API requests.
+
+    Each key refills at its own rate. acquire() hands out the least-loaded
+    key that is not cooling down after a 429, waiting for a token when every
+    key is exhausted.
+    """
+
+    def __init__(self, keys: dict, rate: float, burst: float, cooldown: float = 30, max_cooldown: float = 300):
+        now = time.monotonic()
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.keys = {}
+        for label, (secret, key_rate) in keys.items():
+            self.keys[label] = {
+                "secret": secret,
+                "rate": key_rate or rate,
+                "burst": burst,
+                "tokens": burst,
+                "updated": now,
+                "cooldown_until": 0.0,
+                "consecutive_throttles": 0,
+                "in_flight": 0,
+                "requests": 0,
+                "throttled": 0,
+                "errors": 0
+            }
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        for key in self.keys.values():
+            key["tokens"] = min(key["burst"], key["tokens"] + (now - key["updated"]) * key["rate"])
+            key["updated"] = now
+
+    async def acquire(self):
+        if not self.keys:
+            raise RuntimeError("No marketplace API keys configured")
+
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            ready = [label for label, key in self.keys.items() if key["cooldown_until"] <= now]
+            if ready:
+                label = max(ready, key=lambda k: (self.keys[k]["tokens"], -self.keys[k]["in_flight"]))
+                key = self.keys[label]
+                if key["tokens"] >= 1:
+                    key["tokens"] -= 1
+                    key["in_flight"] += 1
+                    key["requests"] += 1
+                    return label, key["secret"]
+                delay = (1 - key["tokens"]) / key["rate"]
+            else:
+                delay = min(key["cooldown_until"] for key in self.keys.values()) - now
+
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def release(self, label: str, status: int = None):
+        key = self.keys[label]
+        key["in_flight"] -= 1
+
+        if status == 429:
+            key["throttled"] += 1
+            key["consecutive_throttles"] += 1
+            pause = min(self.max_cooldown, self.cooldown * key["consecutive_throttles"])
+            key["cooldown_until"] = time.monotonic() + pause
+            key["tokens"] = 0
+            print(f"API key {label} throttled, cooling down for {pause:.0f}s.")
+            return
+
+        if status != 200:
+            key["errors"] += 1
+        key["consecutive_throttles"] = 0
+
+    def snapshot(self):
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "waited_seconds": round(self.waited, 3),
+            "keys": {
+                label: {
+                    "rate": key["rate"],
+                    "tokens": round(key["tokens"], 2),
+                    "in_flight": key["in_flight"],
+                    "requests": key["requests"],
+                    "throttled": key["throttled"],
+                    "errors": key["errors"],
+                    "cooldown_remaining": round(max(0.0, key["cooldown_until"] - now), 1)
+                }
+                for label, key in self.keys.items()
+            }
+        }
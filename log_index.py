@@ -0,0 +1,141 @@
+import csv
+import heapq
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class LogIndex:
+    """Time order of a buyers append log, for answering "what is newer than X".
+
+    Rows are kept as byte offsets into the log, sorted by (timestamp, append
+    position), so a cursor is found by binary search and only the rows after
+    it are read back. The log is tailed like the unique services do: each
+    refresh parses just the bytes appended since the last one.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.reset(None)
+
+    def reset(self, inode):
+        self.inode = inode
+        self.size = 0
+        self.header = None
+        self.timestamps = array("q")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        # Row numbers ordered by (timestamp, row number).
+        self.order = []
+        # Last row of each transaction, which is where a txHash cursor points.
+        self.tx_rows = {}
+        # Rows of each buyer (lowercase) and asset id, in log order, for the sales query.
+        self.buyer_rows = {}
+        self.asset_rows = {}
+        self.buyers = []
+        self.tokens = []
+        self.real_prices = []
+
+    def refresh(self):
+        stat = os.stat(self.filename)
+        if stat.st_ino != self.inode or stat.st_size < self.size:
+            self.reset(stat.st_ino)
+        if stat.st_size == self.size:
+            return
+
+        with open(self.filename, 'rb') as f:
+            f.seek(self.size)
+            data = f.read(stat.st_size - self.size)
+
+        # Only complete lines; a row still being appended is picked up next time.
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].split(b"\n")[:-1]
+        offset = self.size
+        first_new = len(self.timestamps)
+        for line, row in zip(lines, csv.reader(line.decode() for line in lines)):
+            if self.header is None:
+                self.header = row
+                self.ts_index = row.index("timestamp")
+                self.tx_index = row.index("txHash")
+                self.price_index = row.index("price")
+                # Logs from before realPrice/token were kept only have the display price.
+                self.real_price_index = row.index("realPrice") if "realPrice" in row else None
+            elif row:
+                self.add(int(row[self.ts_index]), row[self.tx_index], offset, len(line) + 1)
+                added = len(self.timestamps) - 1
+                self.buyer_rows.setdefault(row[0].lower(), []).append(added)
+                self.buyers.append(row[0])
+                # Column 1 is the asset id, "<id> <n>x" for collections sold in quantities.
+                self.asset_rows.setdefault(row[1].split(" ")[0], []).append(added)
+                if self.real_price_index is not None and row[self.real_price_index]:
+                    self.real_prices.append(int(row[self.real_price_index]))
+                else:
+                    self.real_prices.append(None)
+                self.tokens.append(row[self.price_index].split()[-1])
+            offset += len(line) + 1
+        self.size += end
+
+        # Pages are appended newest first, so the new rows are sorted on their
+        # own. A polled page is newer than everything before it and simply
+        # extends the order; a backfilled one lands further back and is
+        # merged into the tail it overlaps.
+        new_rows = sorted(range(first_new, len(self.timestamps)), key=self._key)
+        if self.order and new_rows and self._key(self.order[-1]) > self._key(new_rows[0]):
+            start = bisect_right(self.order, self._key(new_rows[0]), key=self._key)
+            self.order[start:] = heapq.merge(self.order[start:], new_rows, key=self._key)
+        else:
+            self.order.extend(new_rows)
+
+    def snapshot(self):
+        """A copy that keeps the current rows while this index is refreshed.
+
+        Only the order is copied: the columns are appended to and a reset
+        replaces them rather than clearing them, so the copy's view of them
+        does not change. For reading rows in order, not for lookups.
+        """
+        copy = LogIndex.__new__(LogIndex)
+        copy.__dict__.update(self.__dict__)
+        copy.order = self.order[:]
+        return copy
+
+    def add(self, timestamp: int, tx_hash: str, offset: int, length: int):
+        row = len(self.timestamps)
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.tx_rows[tx_hash] = row
+
+    def _key(self, row: int):
+        return self.timestamps[row], row
+
+    def after(self, since: int = None, tx_hash: str = None):
+        """Row numbers newer than a timestamp or a txHash, newest first.
+
+        An unknown txHash, such as one from a previous week, matches the
+        whole log.
+        """
+        if tx_hash is not None:
+            row = self.tx_rows.get(tx_hash)
+            start = 0 if row is None else bisect_right(self.order, self._key(row), key=self._key)
+        else:
+            start = bisect_right(self.order, since, key=self.timestamps.__getitem__)
+        # Newest first with ties in log order, like the downloads.
+        return sorted(self.order[start:], key=lambda row: (-self.timestamps[row], row))
+
+    def newest_first(self, since: int = None, until: int = None):
+        """Row numbers with since <= timestamp < until, newest first, ties in log order."""
+        timestamp = self.timestamps.__getitem__
+        low = 0 if since is None else bisect_left(self.order, since, key=timestamp)
+        high = len(self.order) if until is None else bisect_left(self.order, until, key=timestamp)
+        while high > low:
+            tie_start = bisect_left(self.order, self.timestamps[self.order[high - 1]], low, high, key=timestamp)
+            yield from self.order[tie_start:high]
+            high = tie_start
+
+    def read_rows(self, rows: list):
+        """The given rows read back from the log and parsed, in that order."""
+        lines = []
+        with open(self.filename, 'rb') as f:
+            for row in rows:
+                lines.append(os.pread(f.fileno(), self.lengths[row], self.offsets[row]).decode())
+        return list(csv.reader(lines))
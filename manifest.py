@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+# Every collection's weeks with their row count and per-token volume, kept by
+# the tracker as it writes so listings never have to scan the directories.
+MANIFEST_FILE = os.getenv("MANIFEST_FILE", "./weeks_manifest.json")
+
+
+class WeekManifest:
+    """Week index per collection: {week_start: {rows, volume, closed}}.
+
+    Volumes are integer base units per token symbol. The tracker updates it
+    from both the event loop and I/O threads, hence the lock.
+    """
+
+    def __init__(self, filename: str = MANIFEST_FILE):
+        self.filename = filename
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.mtime_ns = None
+
+    def load(self):
+        """Read the persisted manifest; False if there is none yet."""
+        try:
+            with open(self.filename, 'r') as f:
+                stat = os.fstat(f.fileno())
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        collections = {}
+        for name, weeks in data.get("collections", {}).items():
+            collections[name] = {
+                int(week_start): {
+                    "rows": week["rows"],
+                    "volume": {token: int(units) for token, units in week["volume"].items()},
+                    "closed": week["closed"]
+                }
+                for week_start, week in weeks.items()
+            }
+        with self.lock:
+            self.collections = collections
+            self.mtime_ns = stat.st_mtime_ns
+        return True
+
+    def reload_if_changed(self):
+        # For processes that only read it: one stat per call.
+        try:
+            mtime_ns = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime_ns != self.mtime_ns:
+            return self.load()
+        return False
+
+    def save(self):
+        with self.lock:
+            encoded = json.dumps({
+                "collections": {
+                    name: {
+                        str(week_start): {
+                            "rows": week["rows"],
+                            "volume": {token: str(units) for token, units in week["volume"].items()},
+                            "closed": week["closed"]
+                        }
+                        for week_start, week in weeks.items()
+                    }
+                    for name, weeks in self.collections.items()
+                }
+            })
+        # Saved from the loop and from I/O threads; each writes its own temp
+        # file and the last os.replace wins with a complete snapshot.
+        tmp_filename = f"{self.filename}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write(encoded)
+        os.replace(tmp_filename, self.filename)
+
+    def has_week(self, name: str, week_start: int):
+        return week_start in self.collections.get(name, {})
+
+    def is_closed(self, name: str, week_start: int):
+        with self.lock:
+            return self.collections.get(name, {}).get(week_start, {}).get("closed", False)
+
+    def set_week(self, name: str, week_start: int, rows: int, volume: dict, closed: bool = False):
+        with self.lock:
+            self.collections.setdefault(name, {})[week_start] = {
+                "rows": rows,
+                "volume": dict(volume),
+                "closed": closed
+            }
+
+    def add_records(self, name: str, week_start: int, records: list):
+        with self.lock:
+            week = self.collections.setdefault(name, {}).setdefault(
+                week_start, {"rows": 0, "volume": {}, "closed": False}
+            )
+            week["rows"] += len(records)
+            for record in records:
+                week["volume"][record["token"]] = week["volume"].get(record["token"], 0) + int(record["realPrice"])
+
+    def weeks(self, name: str):
+        """{week_start: entry} newest first."""
+        with self.lock:
+            weeks = self.collections.get(name, {})
+            return {
+                week_start: dict(weeks[week_start], volume=dict(weeks[week_start]["volume"]))
+                for week_start in sorted(weeks, reverse=True)
+            }
+
+    def latest(self, name: str):
+        with self.lock:
+            weeks = self.collections.get(name)
+            return max(weeks) if weeks else None
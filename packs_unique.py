@@ -1,13 +1,45 @@
 import os
+import io
+import json
 import asyncio
 from collections import defaultdict
-from fastapi import FastAPI, Response
+from decimal import Decimal
+from fastapi import FastAPI, HTTPException, Request, Response
 import uvicorn
 from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
 import csv
+import aggregate
+import manifest
+import sales_db
+import segments
+import streaming
+
+load_dotenv()
 
 app = FastAPI()
 
+TOKEN_DECIMALS = {
+    "WETH": 18,
+    "AXS": 18,
+    "USDC": 6,
+    "WRON": 18
+}
+
+# With STORAGE_BACKEND=sqlite the tracker's database is read instead of the
+# weekly buyers CSV.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv")
+SALES_DB = os.getenv("SALES_DB", "./sales.db")
+DB = sales_db.connect(SALES_DB) if STORAGE_BACKEND == "sqlite" else None
+
+# The tracker's week index. The running totals follow the clock, but the
+# tracker polls an ending week one last time after it is over, so a past
+# week's file is rebuilt from the closed week once the manifest marks it
+# closed. The weeks rebuilt so far are kept in CLOSED_WEEKS_FILE.
+MANIFEST = manifest.WeekManifest()
+CLOSED_WEEKS_FILE = "./packs_unique/closed_weeks.json"
+closed_weeks = None
+
 
 def get_week_timestamps():
     initial_start = datetime(
@@ -41,55 +73,180 @@ def get_current_unique_filename():
     return f"./packs_unique/packs_unique_{start_ts}.csv"
 
 
-def load_buyers():
-    filename = get_current_buyers_filename()
-    if os.path.exists(filename):
-        try:
-            records = []
-            with open(filename, 'r', newline='') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if isinstance(row.get('timestamp'), str):
-                        row['timestamp'] = int(row['timestamp'])
-                    records.append(row)
-            return records
-        except Exception as e:
-            print(f"Error loading buyers file: {e}")
-    return []
+# Running totals for the week being aggregated, plus how far into the
+# buyers log they cover, so each tick only parses newly appended rows.
+aggregate_state = {
+    "filename": None,
+    "inode": None,
+    "offset": 0,
+    "columns": None,
+    "totals": defaultdict(lambda: defaultdict(int))
+}
+
+
+def reset_aggregate_state(filename, inode):
+    aggregate_state["filename"] = filename
+    aggregate_state["inode"] = inode
+    aggregate_state["offset"] = 0
+    aggregate_state["columns"] = None
+    aggregate_state["totals"] = defaultdict(lambda: defaultdict(int))
+
+
+def read_new_rows(filename):
+    stat = os.stat(filename)
+    if (filename != aggregate_state["filename"]
+            or stat.st_ino != aggregate_state["inode"]
+            or stat.st_size < aggregate_state["offset"]):
+        reset_aggregate_state(filename, stat.st_ino)
+
+    if stat.st_size == aggregate_state["offset"]:
+        return []
+
+    with open(filename, 'rb') as f:
+        f.seek(aggregate_state["offset"])
+        data = f.read()
+
+    # Only consume complete lines; a row still being appended is picked up
+    # on the next tick.
+    end = data.rfind(b"\n") + 1
+    if end == 0:
+        return []
+    aggregate_state["offset"] += end
+
+    rows = list(csv.reader(io.StringIO(data[:end].decode())))
+    if aggregate_state["columns"] is None and rows:
+        header = rows.pop(0)
+        aggregate_state["columns"] = {column: i for i, column in enumerate(header)}
+    return rows
+
+
+def read_new_db_rows():
+    # Here the state is keyed on the week and "offset" is the last rowid read.
+    start_ts, end_ts = get_week_timestamps()
+    if aggregate_state["filename"] != start_ts:
+        reset_aggregate_state(start_ts, None)
+        aggregate_state["columns"] = {column: i for i, column in enumerate(sales_db.ROW_COLUMNS)}
+
+    rows, aggregate_state["offset"] = sales_db.rows_since(DB, "packs", start_ts, end_ts, aggregate_state["offset"])
+    return rows
+
+
+def format_amount(units, token):
+    amount = Decimal(units).scaleb(-TOKEN_DECIMALS[token])
+    if amount == amount.to_integral_value():
+        return str(int(amount))
+    return f"{amount:.2f}".rstrip('0').rstrip('.')
+
+
+def write_unique_file(filename, unique_buyers):
+    csv_data = []
+    for buyer, tokens in unique_buyers.items():
+        row = {"Address": buyer}
+        for token, units in tokens.items():
+            row[token] = format_amount(units, token)
+        csv_data.append(row)
+
+    csv_data.sort(key=lambda x: x["Address"].lower())
+
+    # Written aside and swapped in, so a download running concurrently
+    # never sees a half-written file.
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'w', newline='') as f:
+        fieldnames = ["Address"] + sorted(list({token for row in csv_data for token in row.keys() if token != "Address"}))
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(csv_data)
+    os.replace(tmp_filename, filename)
 
 
 def update_unique_buyers():
     try:
-        buyer_records = load_buyers()
-        if not buyer_records:
-            return
-
-        unique_buyers = defaultdict(lambda: defaultdict(float))
-        for record in buyer_records:
-            buyer = record["buyer"]
-            amount_str, token = record["price"].split()
-            unique_buyers[buyer][token] += float(amount_str)
-
-        csv_data = []
-        for buyer, tokens in unique_buyers.items():
-            row = {"Address": buyer}
-            for token, amount in tokens.items():
-                row[token] = f"{amount:.2f}".rstrip('0').rstrip('.') if not amount.is_integer() else str(int(amount))
-            csv_data.append(row)
-
-        csv_data.sort(key=lambda x: x["Address"].lower())
-        filename = get_current_unique_filename()
-
-        with open(filename, 'w', newline='') as f:
-            fieldnames = ["Address"] + sorted(list({token for row in csv_data for token in row.keys() if token != "Address"}))
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(csv_data)
+        if DB is not None:
+            new_rows = read_new_db_rows()
+        else:
+            filename = get_current_buyers_filename()
+            if not os.path.exists(filename):
+                return False
+            new_rows = read_new_rows(filename)
+        if not new_rows:
+            return False
+
+        # Totals are exact integer base units; the buyers log carries
+        # realPrice, and only logs written before it did need the display
+        # price parsed back.
+        unique_buyers = aggregate_state["totals"]
+        columns = aggregate_state["columns"]
+        buyer_index = columns["buyer"]
+        if "realPrice" in columns:
+            real_price_index = columns["realPrice"]
+            token_index = columns["token"]
+            for row in new_rows:
+                unique_buyers[row[buyer_index]][row[token_index]] += int(row[real_price_index])
+        else:
+            price_index = columns["price"]
+            for row in new_rows:
+                amount_str, token = row[price_index].split()
+                unique_buyers[row[buyer_index]][token] += int(Decimal(amount_str).scaleb(TOKEN_DECIMALS[token]))
+
+        write_unique_file(get_current_unique_filename(), unique_buyers)
+        return True
 
     except Exception as e:
         print(f"Error updating packs unique buyers: {e}")
 
 
+def closed_week_totals(start_ts):
+    """Per-buyer totals of a week the tracker has closed.
+
+    Closed weeks are segments under either backend, summed from their typed
+    arrays; a week without one had no sales, or predates segments under the
+    database.
+    """
+    segment_filename = f"./packs_buyers/packs_buyers_{start_ts}.seg"
+    if os.path.exists(segment_filename):
+        segment = segments.Segment(segment_filename)
+        try:
+            return aggregate.buyer_token_totals(segment)
+        finally:
+            segment.close()
+    totals = defaultdict(lambda: defaultdict(int))
+    if DB is not None:
+        for row in sales_db.week_rows(DB, "packs", start_ts, start_ts + 7 * 24 * 60 * 60):
+            totals[row[0]][row[7]] += int(row[6])
+    return totals
+
+
+def finish_closed_weeks():
+    """Rebuild the files of past weeks the tracker has closed since; True if any was."""
+    global closed_weeks
+    try:
+        if closed_weeks is None:
+            try:
+                with open(CLOSED_WEEKS_FILE, 'r') as f:
+                    closed_weeks = set(json.load(f))
+            except FileNotFoundError:
+                closed_weeks = set()
+        MANIFEST.reload_if_changed()
+        current_ts, _ = get_week_timestamps()
+        pending = sorted(
+            week_start for week_start, week in MANIFEST.weeks("packs").items()
+            if week["closed"] and week_start < current_ts and week_start not in closed_weeks
+        )
+        for week_start in pending:
+            os.makedirs("./packs_unique", exist_ok=True)
+            write_unique_file(f"./packs_unique/packs_unique_{week_start}.csv", closed_week_totals(week_start))
+            closed_weeks.add(week_start)
+            tmp_filename = f"{CLOSED_WEEKS_FILE}.tmp"
+            with open(tmp_filename, 'w') as f:
+                json.dump(sorted(closed_weeks), f)
+            os.replace(tmp_filename, CLOSED_WEEKS_FILE)
+            print(f"Rebuilt packs unique buyers of closed week {week_start}")
+        return bool(pending)
+    except Exception as e:
+        print(f"Error finishing closed packs weeks: {e}")
+        return False
+
+
 def find_latest_csv(directory: str, prefix: str) -> str:
     try:
         files = os.listdir(directory)
@@ -107,35 +264,34 @@ def find_latest_csv(directory: str, prefix: str) -> str:
 
 
 @app.get("/packs_unique/{timestamp}")
-async def get_unique_with_timestamp(timestamp: int):
+async def get_unique_with_timestamp(timestamp: int, request: Request):
     filename = f"./packs_unique/packs_unique_{timestamp}.csv"
-    return _serve_csv(filename)
+    # A past week's file still changes until it is rebuilt from the closed
+    # week, so only the rebuilt ones are final.
+    immutable = closed_weeks is not None and timestamp in closed_weeks
+    return await asyncio.to_thread(_serve_csv, filename, request.headers, immutable)
 
 
 @app.get("/packs_unique/")
-async def get_current_unique():
+async def get_current_unique(request: Request):
     current_ts, _ = get_week_timestamps()
     current_filename = f"./packs_unique/packs_unique_{current_ts}.csv"
 
     if os.path.exists(current_filename):
-        return _serve_csv(current_filename)
+        return await asyncio.to_thread(_serve_csv, current_filename, request.headers)
     else:
-        latest_file = find_latest_csv("./packs_unique", "packs_unique_")
+        latest_file = await asyncio.to_thread(find_latest_csv, "./packs_unique", "packs_unique_")
         if latest_file:
-            return _serve_csv(latest_file)
+            return await asyncio.to_thread(_serve_csv, latest_file, request.headers)
         else:
             raise HTTPException(status_code=404, detail="No unique data found")
 
 
-def _serve_csv(filename: str) -> Response:
+def _serve_csv(filename: str, request_headers=None, immutable: bool = False) -> Response:
     try:
-        with open(filename, 'rb') as f:
-            content = f.read()
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={'Content-Disposition': f'attachment; filename={os.path.basename(filename)}'}
-            )
+        return streaming.file_response(filename, request_headers, immutable=immutable)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
 
@@ -145,11 +301,24 @@ async def startup_event():
     asyncio.create_task(background_task())
 
 
+# Re-check quickly while the buyers log is growing and fall back to the old
+# one-minute cadence once it goes quiet.
+MIN_INTERVAL = 10
+MAX_INTERVAL = 60
+
+
 async def background_task():
+    interval = MAX_INTERVAL
     while True:
         os.makedirs("./packs_unique", exist_ok=True)
-        update_unique_buyers()
-        await asyncio.sleep(60)
+        # Reading and rewriting the week's files happens on a worker thread
+        # so downloads keep being served meanwhile.
+        updated = await asyncio.to_thread(update_unique_buyers)
+        if await asyncio.to_thread(finish_closed_weeks) or updated:
+            interval = MIN_INTERVAL
+        else:
+            interval = min(MAX_INTERVAL, interval * 2)
+        await asyncio.sleep(interval)
 
 
 if __name__ == "__main__":
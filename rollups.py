@@ -0,0 +1,115 @@
+import threading
+
+# Partial aggregates for range queries. Each week keeps one bucket per hour
+# and one for the whole week; a [start, end) range is answered by merging the
+# whole weeks and whole hours it covers and scanning only the rows in its
+# partial first and last hour.
+HOUR = 60 * 60
+WEEK = 7 * 24 * HOUR
+
+
+def empty_bucket(by_buyer: bool = True):
+    # Without per-buyer totals a result only needs the set of buyers, which
+    # merges far faster than nested dictionaries.
+    return {"sales": 0, "volume": {}, "buyers": {} if by_buyer else set()}
+
+
+def add_sale(bucket: dict, buyer: str, token: str, units: int):
+    bucket["sales"] += 1
+    bucket["volume"][token] = bucket["volume"].get(token, 0) + units
+    if isinstance(bucket["buyers"], set):
+        bucket["buyers"].add(buyer)
+        return
+    tokens = bucket["buyers"].setdefault(buyer, {})
+    tokens[token] = tokens.get(token, 0) + units
+
+
+def merge(into: dict, bucket: dict):
+    into["sales"] += bucket["sales"]
+    for token, units in bucket["volume"].items():
+        into["volume"][token] = into["volume"].get(token, 0) + units
+    if isinstance(into["buyers"], set):
+        into["buyers"].update(bucket["buyers"])
+        return
+    for buyer, tokens in bucket["buyers"].items():
+        totals = into["buyers"].setdefault(buyer, {})
+        for token, units in tokens.items():
+            totals[token] = totals.get(token, 0) + units
+
+
+class WeekRollup:
+    """Hourly and whole-week buckets of one collection's week.
+
+    Closed weeks are built once from their segment; the live week is fed as
+    sales are ingested, from the loop, while queries read it from I/O
+    threads, hence the lock.
+    """
+
+    def __init__(self, week_start: int):
+        self.week_start = week_start
+        self.week = empty_bucket()
+        self.hours = {}
+        self.lock = threading.Lock()
+
+    def add(self, timestamp: int, buyer: str, token: str, units: int):
+        hour = timestamp - (timestamp - self.week_start) % HOUR
+        with self.lock:
+            add_sale(self.week, buyer, token, units)
+            add_sale(self.hours.setdefault(hour, empty_bucket()), buyer, token, units)
+
+    def merge_week(self, into: dict):
+        with self.lock:
+            merge(into, self.week)
+
+    def merge_hours(self, into: dict, start: int, end: int):
+        """Merge the hours in [start, end), both on hour boundaries."""
+        with self.lock:
+            for hour in range(start, end, HOUR):
+                if hour in self.hours:
+                    merge(into, self.hours[hour])
+
+
+def segment_rollup(week_start: int, segment):
+    rollup = WeekRollup(week_start)
+    symbols, buyers = segment.footer["token_symbols"], {}
+    buyer_codes, token_codes = segment.buyer_codes(), segment.token_codes()
+    for i, timestamp in enumerate(segment.timestamps()):
+        code = buyer_codes[i]
+        if code not in buyers:
+            buyers[code] = segment.buyer(code)
+        rollup.add(timestamp, buyers[code], symbols[token_codes[i]], segment.real_price(i))
+    return rollup
+
+
+def aggregate(week_starts: list, start: int, end: int, rollup_for, scan, by_buyer: bool = True):
+    """One bucket for [start, end) over the given weeks.
+
+    rollup_for(week_start) returns the week's WeekRollup or None; scan(week_start,
+    since, until) yields (timestamp, buyer, token, units) for the rows in a
+    sub-hour edge.
+    """
+    result = empty_bucket(by_buyer)
+    for week_start in week_starts:
+        low, high = max(start, week_start), min(end, week_start + WEEK)
+        if low >= high:
+            continue
+        rollup = rollup_for(week_start)
+        if rollup is None:
+            continue
+        if low == week_start and high == week_start + WEEK:
+            rollup.merge_week(result)
+            continue
+
+        # Weeks start on the hour, so hour boundaries are the same in all of them.
+        first_hour = low + (week_start - low) % HOUR
+        last_hour = high - (high - week_start) % HOUR
+        if first_hour >= last_hour:
+            edges = [(low, high)]
+        else:
+            rollup.merge_hours(result, first_hour, last_hour)
+            edges = [(low, first_hour), (last_hour, high)]
+        for since, until in edges:
+            if since < until:
+                for _, buyer, token, units in scan(week_start, since, until):
+                    add_sale(result, buyer, token, units)
+    return result
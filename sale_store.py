@@ -0,0 +1,88 @@
+from array import array
+from decimal import Decimal
+
+
+class SaleStore:
+    """One week of a collection's sales, kept column by column.
+
+    Addresses and tx hashes are stored as raw bytes, prices as integer base
+    units and purchases are deduplicated through a set of key hashes, so a
+    sale costs under 200 bytes instead of the ~700 of a dict of strings plus
+    an f-string key.
+    """
+
+    ADDRESS_SIZE = 20
+    HASH_SIZE = 32
+    PRICE_SIZE = 16
+
+    def __init__(self, token_decimals: dict):
+        self.token_decimals = token_decimals
+        self.token_symbols = list(token_decimals)
+        self.token_index = {symbol: i for i, symbol in enumerate(self.token_symbols)}
+        self.buyers = bytearray()
+        self.tx_hashes = bytearray()
+        self.prices = bytearray()
+        self.timestamps = array("q")
+        self.tokens = array("B")
+        self.asset_ids = array("Q")
+        self.quantities = array("I")
+        # Asset ids that do not fit the integer column, keyed by row.
+        self.odd_asset_ids = {}
+        self.keys = set()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __contains__(self, purchase_id: str):
+        return hash(purchase_id) in self.keys
+
+    def add(self, purchase_id: str, buyer: str, asset_id, tx_hash: str, timestamp: int, price: int, token: str, quantity: int = 1):
+        """Append a sale unless its purchase key was already seen."""
+        key = hash(purchase_id)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+
+        row = len(self.timestamps)
+        self.buyers += _hex_to_bytes(buyer, self.ADDRESS_SIZE)
+        self.tx_hashes += _hex_to_bytes(tx_hash, self.HASH_SIZE)
+        self.prices += price.to_bytes(self.PRICE_SIZE, "big")
+        self.timestamps.append(timestamp)
+        self.tokens.append(self.token_index[token])
+        self.quantities.append(quantity)
+        try:
+            self.asset_ids.append(int(asset_id))
+        except (TypeError, ValueError, OverflowError):
+            self.asset_ids.append(0)
+            self.odd_asset_ids[row] = asset_id
+        return True
+
+    def forget(self, purchase_ids: list):
+        """Drop the newest sales, added under these keys, when they could not be persisted."""
+        keep = len(self.timestamps) - len(purchase_ids)
+        for purchase_id in purchase_ids:
+            self.keys.discard(hash(purchase_id))
+        del self.buyers[keep * self.ADDRESS_SIZE:]
+        del self.tx_hashes[keep * self.HASH_SIZE:]
+        del self.prices[keep * self.PRICE_SIZE:]
+        for column in (self.timestamps, self.tokens, self.asset_ids, self.quantities):
+            del column[keep:]
+        for row in [row for row in self.odd_asset_ids if row >= keep]:
+            del self.odd_asset_ids[row]
+
+    def parse_price(self, price: str):
+        """Turn a display price such as "1.5 WETH" into (base units, symbol)."""
+        amount, token = price.split()
+        return int(Decimal(amount).scaleb(self.token_decimals[token])), token
+
+    def max_timestamp(self, default: int = None):
+        return max(self.timestamps) if self.timestamps else default
+
+
+def _hex_to_bytes(value: str, size: int):
+    if value and value.startswith("0x") and len(value) == 2 + 2 * size:
+        try:
+            return bytes.fromhex(value[2:])
+        except ValueError:
+            pass
+    return bytes(size)
@@ -0,0 +1,45 @@
+from typing import Dict, List, Optional, Union
+
+import msgspec
+
+
+# Decoded straight from the response bytes. Fields the structs do not
+# declare (asset metadata, attribute blobs) are skipped by the parser
+# instead of being materialised and thrown away.
+class Asset(msgspec.Struct, gc=False):
+    id: Union[str, int, None] = None
+
+
+class Sale(msgspec.Struct, gc=False):
+    maker: Optional[str] = None
+    matcher: Optional[str] = None
+    paymentToken: Optional[str] = None
+    realPrice: Union[str, int] = 0
+    timestamp: int = 0
+    txHash: Optional[str] = None
+    orderKind: Optional[int] = None
+    quantity: Union[int, str] = 1
+    orderId: Union[int, str, None] = None
+    assets: List[Asset] = []
+
+
+class SalesPage(msgspec.Struct, gc=False):
+    # None, unlike [], does not mean the end of the history.
+    results: Optional[List[Sale]] = None
+
+
+class PageData(msgspec.Struct, gc=False):
+    recentlySolds: Optional[SalesPage] = None
+
+
+class PageResponse(msgspec.Struct, gc=False):
+    data: Optional[PageData] = None
+
+
+class BatchResponse(msgspec.Struct, gc=False):
+    # Keyed by the collection alias; an alias is null when that block failed.
+    data: Optional[Dict[str, Optional[SalesPage]]] = None
+
+
+page_decoder = msgspec.json.Decoder(PageResponse)
+batch_decoder = msgspec.json.Decoder(BatchResponse)
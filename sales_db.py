@@ -0,0 +1,225 @@
+import sqlite3
+from decimal import Decimal
+
+# realPrice is kept as text: 18-decimal amounts overflow SQLite's 64-bit
+# integers, and nothing sums it in SQL.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales (
+    collection TEXT NOT NULL,
+    purchase_key TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    buyer TEXT NOT NULL,
+    price TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    real_price TEXT NOT NULL,
+    token TEXT NOT NULL,
+    UNIQUE (collection, purchase_key, asset_id, quantity)
+);
+CREATE INDEX IF NOT EXISTS sales_by_timestamp ON sales (collection, timestamp);
+DROP INDEX IF EXISTS sales_by_buyer;
+CREATE INDEX IF NOT EXISTS sales_by_buyer_address ON sales (lower(buyer), collection);
+CREATE INDEX IF NOT EXISTS sales_by_tx ON sales (collection, tx_hash);
+CREATE INDEX IF NOT EXISTS sales_by_asset ON sales (collection, asset_id);
+"""
+
+# Column order of the rows returned below, named like the buyers CSV so the
+# same lookups work on either.
+ROW_COLUMNS = ("buyer", "asset_id", "quantity", "price", "txHash", "timestamp", "realPrice", "token", "purchaseKey")
+
+_SELECT_ROW = "SELECT buyer, asset_id, quantity, price, tx_hash, timestamp, real_price, token, purchase_key FROM sales"
+
+
+def connect(path: str):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets the unique services read while the tracker writes.
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def split_purchase_id(purchase_id: str):
+    """Split "<txHash or orderId>_<asset id>[_<quantity>]" into its key columns."""
+    parts = purchase_id.split("_")
+    return parts[0], parts[1], int(parts[2]) if len(parts) > 2 else 1
+
+
+class SaleTable:
+    """One collection's week in the sales database, usable where a SaleStore is.
+
+    Deduplication is the table's unique constraint, so nothing is loaded into
+    memory on start. Added sales are queued until write(), which the caller
+    follows with a commit in the same step: every collection shares the
+    connection, so an insert left pending across an await could be committed
+    or rolled back by another collection's page.
+    """
+
+    def __init__(self, connection, collection: str, week_start: int, week_end: int, token_decimals: dict, format_units):
+        self.connection = connection
+        self.collection = collection
+        self.week_start = week_start
+        self.week_end = week_end
+        self.token_decimals = token_decimals
+        self.format_units = format_units
+        self.pending = {}
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sales WHERE collection = ? AND timestamp >= ? AND timestamp < ?",
+            (self.collection, self.week_start, self.week_end)
+        ).fetchone()[0]
+
+    def __contains__(self, purchase_id: str):
+        if purchase_id in self.pending:
+            return True
+        return self.connection.execute(
+            "SELECT 1 FROM sales WHERE collection = ? AND purchase_key = ? AND asset_id = ? AND quantity = ?",
+            (self.collection, *split_purchase_id(purchase_id))
+        ).fetchone() is not None
+
+    def add(self, purchase_id: str, buyer: str, asset_id, tx_hash: str, timestamp: int, price: int, token: str, quantity: int = 1):
+        """Queue a sale unless its purchase key is already in the table or queued."""
+        purchase_key, _, _ = split_purchase_id(purchase_id)
+        if purchase_id in self.pending or self.connection.execute(
+            "SELECT 1 FROM sales WHERE collection = ? AND purchase_key = ? AND asset_id = ? AND quantity = ?",
+            (self.collection, purchase_key, str(asset_id), quantity)
+        ).fetchone() is not None:
+            return False
+        self.pending[purchase_id] = (self.collection, purchase_key, str(asset_id), quantity, buyer,
+                                     self.format_units(price, token), tx_hash, timestamp, str(price), token)
+        return True
+
+    def write(self, purchase_ids: list):
+        """Insert the queued sales of these purchase ids; the caller commits."""
+        rows = [self.pending.pop(purchase_id) for purchase_id in purchase_ids if purchase_id in self.pending]
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO sales (collection, purchase_key, asset_id, quantity, buyer, price, tx_hash, timestamp, real_price, token)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def forget(self, purchase_ids: list):
+        # Sales whose commit failed were rolled back with the transaction;
+        # ones still queued are dropped, so the next poll fetches them again.
+        for purchase_id in purchase_ids:
+            self.pending.pop(purchase_id, None)
+
+    def parse_price(self, price: str):
+        """Turn a display price such as "1.5 WETH" into (base units, symbol)."""
+        amount, token = price.split()
+        return int(Decimal(amount).scaleb(self.token_decimals[token])), token
+
+    def max_timestamp(self, default: int = None):
+        newest = self.connection.execute(
+            "SELECT MAX(timestamp) FROM sales WHERE collection = ? AND timestamp >= ? AND timestamp < ?",
+            (self.collection, self.week_start, self.week_end)
+        ).fetchone()[0]
+        return default if newest is None else newest
+
+
+def week_rows(connection, collection: str, week_start: int, week_end: int):
+    """A cursor over a week's sales newest first, in ROW_COLUMNS order."""
+    return connection.execute(
+        f"{_SELECT_ROW} WHERE collection = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp DESC, rowid",
+        (collection, week_start, week_end)
+    )
+
+
+def week_version(connection, collection: str, week_start: int, week_end: int):
+    """(row count, newest rowid) of a week, which changes whenever a sale lands."""
+    return connection.execute(
+        "SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM sales WHERE collection = ? AND timestamp >= ? AND timestamp < ?",
+        (collection, week_start, week_end)
+    ).fetchone()
+
+
+def rows_since(connection, collection: str, week_start: int, week_end: int, after_rowid: int):
+    """A week's sales inserted after after_rowid, and the rowid to resume from.
+
+    Rows are only ever appended, so the rowid works like a byte offset into
+    the CSV log.
+    """
+    rows = connection.execute(
+        f"SELECT rowid, {_SELECT_ROW[len('SELECT '):]} WHERE rowid > ? AND collection = ? AND timestamp >= ? AND timestamp < ? ORDER BY rowid",
+        (after_rowid, collection, week_start, week_end)
+    ).fetchall()
+    if not rows:
+        return [], after_rowid
+    return [row[1:] for row in rows], rows[-1][0]
+
+
+def rows_after(connection, collection: str, week_start: int, week_end: int, since: int = None, tx_hash: str = None):
+    """A week's sales newer than a timestamp or a txHash, newest first.
+
+    Ties on the cursor's timestamp count as newer when inserted after it. An
+    unknown txHash, such as one from another week, matches the whole week.
+    """
+    after_rowid = None
+    if tx_hash is not None:
+        since, after_rowid = connection.execute(
+            "SELECT timestamp, MAX(rowid) FROM sales WHERE collection = ? AND tx_hash = ? AND timestamp >= ? AND timestamp < ?",
+            (collection, tx_hash, week_start, week_end)
+        ).fetchone()
+        if since is None:
+            return week_rows(connection, collection, week_start, week_end)
+    if after_rowid is None:
+        after_rowid = (1 << 63) - 1
+    # The lower bound lets the timestamp index skip everything older.
+    return connection.execute(
+        f"{_SELECT_ROW} WHERE collection = ? AND timestamp >= ? AND timestamp < ? AND (timestamp > ? OR rowid > ?)"
+        " ORDER BY timestamp DESC, rowid",
+        (collection, max(week_start, since), week_end, since, after_rowid)
+    )
+
+
+def query_sales(connection, collections: list, filters: dict, after: list = None, limit: int = 100):
+    """Sales matching filters, newest first across collections.
+
+    Returns (timestamp, collection, rowid, row) tuples with row in
+    ROW_COLUMNS order. filters may hold buyer (lowercase), asset_id, token, start, end
+    and min_units ({token: minimum realPrice}). after is the (timestamp,
+    collection, rowid) of the previous page's last row.
+    """
+    clauses = [f"collection IN ({', '.join('?' * len(collections))})"]
+    params = list(collections)
+    # Buyers are matched by lowercase address, like the buyer profiles.
+    for column, key in (("lower(buyer)", "buyer"), ("asset_id", "asset_id"), ("token", "token")):
+        if filters.get(key) is not None:
+            clauses.append(f"{column} = ?")
+            params.append(filters[key])
+    if filters.get("start") is not None:
+        clauses.append("timestamp >= ?")
+        params.append(filters["start"])
+    if filters.get("end") is not None:
+        clauses.append("timestamp < ?")
+        params.append(filters["end"])
+    if filters.get("min_units"):
+        # real_price is text; for integers without leading zeros, a longer
+        # string is a bigger number and equal lengths compare lexically.
+        matches = []
+        for token, units in filters["min_units"].items():
+            matches.append("(token = ? AND (length(real_price) > ? OR (length(real_price) = ? AND real_price >= ?)))")
+            params += [token, len(str(units)), len(str(units)), str(units)]
+        clauses.append(f"({' OR '.join(matches)})")
+    if after is not None:
+        timestamp, collection, rowid = after
+        clauses.append("timestamp <= ? AND (timestamp < ? OR collection > ? OR (collection = ? AND rowid > ?))")
+        params += [timestamp, timestamp, collection, collection, rowid]
+
+    rows = connection.execute(
+        f"SELECT timestamp, collection, rowid, {_SELECT_ROW[len('SELECT '):]} WHERE {' AND '.join(clauses)}"
+        " ORDER BY timestamp DESC, collection, rowid LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+    return [(row[0], row[1], row[2], row[3:]) for row in rows]
+
+
+def buyer_rows(connection, buyer: str):
+    """(collection, row) for every sale of a buyer, newest first, rows in ROW_COLUMNS order."""
+    rows = connection.execute(
+        f"SELECT collection, {_SELECT_ROW[len('SELECT '):]} WHERE lower(buyer) = ? ORDER BY timestamp DESC, collection, rowid",
+        (buyer.lower(),)
+    ).fetchall()
+    return [(row[0], row[1:]) for row in rows]
@@ -0,0 +1,178 @@
+import base64
+import heapq
+import itertools
+import json
+from bisect import bisect_left
+from decimal import Decimal, ROUND_CEILING
+
+import segments
+
+# Sales across collections as JSON records, newest first, a page at a time.
+# Weeks kept as files are searched through their indexes (segment postings
+# and time order, the live log's LogIndex); the database has its own.
+RECORD_FIELDS = ("collection", "buyer", "asset_id", "price", "txHash", "timestamp", "realPrice", "token")
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(key: list):
+    """Opaque page cursor for [timestamp, collection, position] of a row."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """The key encode_cursor was given; ValueError for anything else."""
+    try:
+        timestamp, collection, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(timestamp, int) or not isinstance(collection, str) or not isinstance(position, int):
+        raise ValueError("Invalid cursor")
+    return [timestamp, collection, position]
+
+
+def min_units(min_price: str, token_decimals: dict):
+    """A display price threshold as the smallest realPrice per token.
+
+    ValueError unless min_price is a finite decimal amount of at least zero.
+    """
+    try:
+        amount = Decimal(min_price)
+    except ArithmeticError:
+        raise ValueError("min_price must be a decimal amount")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError("min_price must be a finite amount of at least zero")
+    return {
+        token: int(amount.scaleb(decimals).to_integral_value(rounding=ROUND_CEILING))
+        for token, decimals in token_decimals.items()
+    }
+
+
+def record(collection: str, header: list, row: list):
+    # Column 1 is named after the collection's id; it is asset_id here.
+    values = dict(zip(["buyer", "asset_id", *header[2:]], row))
+    values["collection"] = collection
+    values["timestamp"] = int(values["timestamp"])
+    return values
+
+
+def _price_matches(filters: dict, token: str, units):
+    if filters.get("token") is not None and token != filters["token"]:
+        return False
+    if filters.get("min_units"):
+        return units is not None and units >= filters["min_units"][token]
+    return True
+
+
+def _segment_matches(collection: str, segment, filters: dict, until: int = None):
+    # Yields (key, source, row index), newest first.
+    end = filters.get("end")
+    until = end if until is None else until if end is None else min(until, end)
+    start, stop = segment.between(filters.get("start"), until)
+    timestamps = segment.timestamps()
+
+    postings = []
+    for name, key in (("buyer", "buyer"), ("asset", "asset_id")):
+        if filters.get(key) is not None:
+            # Postings are ascending like the rows, so the time range is a slice.
+            rows = segment.postings(name, filters[key])
+            postings.append(rows[bisect_left(rows, start):bisect_left(rows, stop)])
+    if postings:
+        postings.sort(key=len)
+        others = [set(rows) for rows in postings[1:]]
+        candidates = (i for i in postings[0] if all(i in rows for rows in others))
+    else:
+        candidates = range(start, stop)
+
+    token_codes, symbols = segment.token_codes(), segment.footer["token_symbols"]
+    for i in candidates:
+        if filters.get("token") is not None or filters.get("min_units"):
+            if not _price_matches(filters, symbols[token_codes[i]], segment.real_price(i)):
+                continue
+        yield (-timestamps[i], collection, i), segment, i
+
+
+def _log_matches(collection: str, index, filters: dict, until: int = None):
+    end = filters.get("end")
+    until = end if until is None else until if end is None else min(until, end)
+    since = filters.get("start")
+
+    postings = []
+    if filters.get("buyer") is not None:
+        postings.append(index.buyer_rows.get(filters["buyer"], []))
+    if filters.get("asset_id") is not None:
+        postings.append(index.asset_rows.get(filters["asset_id"], []))
+    if postings:
+        postings.sort(key=len)
+        matched = set(postings[0]).intersection(*postings[1:])
+        candidates = sorted(
+            (row for row in matched
+             if (since is None or index.timestamps[row] >= since) and (until is None or index.timestamps[row] < until)),
+            key=lambda row: (-index.timestamps[row], row)
+        )
+    else:
+        candidates = index.newest_first(since, until)
+
+    for row in candidates:
+        if _price_matches(filters, index.tokens[row], index.real_prices[row]):
+            yield (-index.timestamps[row], collection, row), index, row
+
+
+def query_files(weeks: dict, open_week, filters: dict, after: list = None, limit: int = DEFAULT_LIMIT):
+    """One page of sales from weeks kept as files.
+
+    weeks maps each collection to its week starts, newest first; open_week
+    (collection, week_start) returns a Segment, a refreshed LogIndex or None.
+    Returns (records, next key or None).
+    """
+    week_length = 7 * 24 * 60 * 60
+    until = None if after is None else after[0] + 1
+    streams = []
+    for collection, week_starts in weeks.items():
+        sources = []
+        for week_start in week_starts:
+            if filters.get("end") is not None and week_start >= filters["end"]:
+                continue
+            if filters.get("start") is not None and week_start + week_length <= filters["start"]:
+                continue
+            if until is not None and week_start >= until:
+                continue
+            source = open_week(collection, week_start)
+            if source is None:
+                continue
+            if isinstance(source, segments.Segment):
+                sources.append(_segment_matches(collection, source, filters, until))
+            else:
+                sources.append(_log_matches(collection, source, filters, until))
+        # Weeks do not overlap, so each collection is its weeks in turn.
+        streams.append(itertools.chain.from_iterable(sources))
+
+    after_key = None if after is None else (-after[0], after[1], after[2])
+    page = []
+    for match in heapq.merge(*streams, key=lambda match: match[0]):
+        if after_key is not None and match[0] <= after_key:
+            continue
+        page.append(match)
+        if len(page) > limit:
+            break
+
+    next_key = None
+    if len(page) > limit:
+        page = page[:limit]
+        timestamp, collection, position = page[-1][0]
+        next_key = [-timestamp, collection, position]
+
+    # Rows are only read back for the page itself, one read per source.
+    records = [None] * len(page)
+    by_source = {}
+    for i, (key, source, position) in enumerate(page):
+        by_source.setdefault(id(source), (source, key[1], []))[2].append((i, position))
+    for source, collection, wanted in by_source.values():
+        positions = [position for _, position in wanted]
+        if isinstance(source, segments.Segment):
+            header, rows = source.footer["header"], source.rows_at(positions)
+        else:
+            header, rows = source.header, source.read_rows(positions)
+        for (i, _), row in zip(wanted, rows):
+            records[i] = record(collection, header, row)
+    return records, next_key
@@ -0,0 +1,401 @@
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+# A closed week as an immutable file: rows newest first, one block per
+# column, then a JSON footer and its length. Timestamps, the buyer/token codes,
+# the base-unit amounts and the postings are raw native arrays read straight
+# out of the mapping.
+# Values read one row at a time are stored at a fixed width, so any row is a
+# slice: tx hashes and the buyer dictionaries as raw 32- and 20-byte values,
+# as SaleStore keeps them, and the asset keys as text. Values that would not
+# come back the same from raw bytes (mixed-case or malformed hex) are kept in
+# the footer instead. The bulky asset and price columns are zlib-compressed
+# BLOCK_ROWS rows at a time, so a read inflates only the blocks it touches.
+# Nothing inflated is kept.
+MAGIC = b"WFSEG4\n"
+# Base-unit amounts overflow int64, so they are kept split at 1e9.
+AMOUNT_SPLIT = 10 ** 9
+TRAILER = struct.Struct("<Q7s")
+BLOCK_ROWS = 1024
+
+
+def segment_filename(csv_filename: str):
+    return csv_filename[:-len(".csv")] + ".seg"
+
+
+def is_current(filename: str):
+    """False for a segment written in an older format, which must be rewritten."""
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _fixed(values: list):
+    encoded = [value.encode() for value in values]
+    width = max(map(len, encoded), default=0)
+    return width, b"".join(value.ljust(width, b"\0") for value in encoded)
+
+
+def _binary(values: list, size: int):
+    # Lowercase 0x-hex of the right length round-trips through raw bytes;
+    # anything else is returned aside, by row, with a blank slot in its place.
+    data, odd = bytearray(), {}
+    for i, value in enumerate(values):
+        raw = None
+        if len(value) == 2 + 2 * size and value.startswith("0x"):
+            try:
+                raw = bytes.fromhex(value[2:])
+            except ValueError:
+                pass
+        if raw is None or "0x" + raw.hex() != value:
+            odd[str(i)] = value
+            raw = bytes(size)
+        data += raw
+    return bytes(data), odd
+
+
+def _blocks(values: list):
+    data, ends = bytearray(), []
+    for start in range(0, len(values), BLOCK_ROWS):
+        data += zlib.compress("\n".join(values[start:start + BLOCK_ROWS]).encode(), 6)
+        ends.append(len(data))
+    return bytes(data), ends
+
+
+def _postings(keys: list):
+    # Rows grouped by key, keys sorted so a lookup is a binary search.
+    grouped = {}
+    for i, key in enumerate(keys):
+        grouped.setdefault(key, []).append(i)
+    ordered = sorted(grouped)
+    rows, starts = array("I"), array("I", [0])
+    for key in ordered:
+        rows.extend(grouped[key])
+        starts.append(len(rows))
+    return ordered, rows, starts
+
+
+def write_segment(filename: str, header: list, rows: list, token_decimals: dict):
+    """Write a week's buyers rows as a segment; header is the CSV header.
+
+    Rows may be in any order. Logs written before realPrice was kept get it
+    parsed back from the display price. Columns past token, such as orderId,
+    are kept as they are.
+    """
+    columns = {column: i for i, column in enumerate(header)}
+    standard = header[:2] + ["price", "txHash", "timestamp", "realPrice", "token"]
+    extra = [column for column in header[2:] if column not in standard]
+    ts_index = columns["timestamp"]
+    rows = sorted(rows, key=lambda row: int(row[ts_index]), reverse=True)
+
+    buyers, buyer_codes = {}, array("I")
+    tokens, token_codes = {}, array("B")
+    timestamps = array("q")
+    units_hi, units_lo = array("q"), array("q")
+    totals = {}
+    for row in rows:
+        if "realPrice" in columns and row[columns["realPrice"]]:
+            units, token = int(row[columns["realPrice"]]), row[columns["token"]]
+        else:
+            amount, token = row[columns["price"]].split()
+            units = int(Decimal(amount).scaleb(token_decimals[token]))
+        buyer = row[columns["buyer"]]
+        buyer_codes.append(buyers.setdefault(buyer, len(buyers)))
+        token_codes.append(tokens.setdefault(token, len(tokens)))
+        timestamps.append(int(row[ts_index]))
+        hi, lo = divmod(units, AMOUNT_SPLIT)
+        units_hi.append(hi)
+        units_lo.append(lo)
+
+        token_totals = totals.setdefault(token, {"units": 0, "sales": 0, "buyers": set()})
+        token_totals["units"] += units
+        token_totals["sales"] += 1
+        token_totals["buyers"].add(buyer)
+
+    tx_hashes = [row[columns["txHash"]] for row in rows]
+    # Buyers are looked up by lowercase address, assets without the "<n>x"
+    # quantity suffix some collections add.
+    buyer_keys, buyer_rows, buyer_starts = _postings([row[columns["buyer"]].lower() for row in rows])
+    asset_keys, asset_rows, asset_starts = _postings([row[1].split(" ")[0] for row in rows])
+    # Ties keep the last row, which is where a txHash cursor points.
+    tx_order = array("I", sorted(range(len(rows)), key=lambda i: (tx_hashes[i], i)))
+
+    blocks, widths, block_ends, odd = {}, {}, {}, {}
+    blocks["timestamp"] = timestamps.tobytes()
+    blocks["buyer"] = buyer_codes.tobytes()
+    blocks["token"] = token_codes.tobytes()
+    blocks["units_hi"] = units_hi.tobytes()
+    blocks["units_lo"] = units_lo.tobytes()
+    for name, values, size in (("buyers", list(buyers), 20), ("txHash", tx_hashes, 32), ("buyer_keys", buyer_keys, 20)):
+        widths[name] = size
+        blocks[name], odd[name] = _binary(values, size)
+    widths["asset_keys"], blocks["asset_keys"] = _fixed(asset_keys)
+    for name, values in (("asset", [row[1] for row in rows]), ("price", [row[columns["price"]] for row in rows])):
+        blocks[name], block_ends[name] = _blocks(values)
+    for column in extra:
+        i = columns[column]
+        blocks[f"extra:{column}"], block_ends[f"extra:{column}"] = _blocks([row[i] if i < len(row) else "" for row in rows])
+    for name, values in (("tx_order", tx_order), ("buyer_rows", buyer_rows), ("buyer_starts", buyer_starts),
+                         ("asset_rows", asset_rows), ("asset_starts", asset_starts)):
+        blocks[name] = values.tobytes()
+
+    footer = {
+        "header": standard + extra,
+        "rows": len(rows),
+        "min_timestamp": timestamps[-1] if rows else None,
+        "max_timestamp": timestamps[0] if rows else None,
+        "buyers": len(buyers),
+        "tokens": {
+            token: {"units": str(t["units"]), "sales": t["sales"], "buyers": len(t["buyers"])}
+            for token, t in totals.items()
+        },
+        "token_symbols": list(tokens),
+        "byteorder": sys.byteorder,
+        "block_rows": BLOCK_ROWS,
+        "widths": widths,
+        "binary": [name for name in odd],
+        "odd": {name: values for name, values in odd.items() if values},
+        "blocks": block_ends,
+        "columns": {}
+    }
+
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(MAGIC)
+        for name, block in blocks.items():
+            # Raw arrays are 8-byte aligned so they can be cast in place.
+            f.write(bytes(-f.tell() % 8))
+            footer["columns"][name] = [f.tell(), len(block)]
+            f.write(block)
+        encoded = json.dumps(footer).encode()
+        f.write(encoded)
+        f.write(TRAILER.pack(len(encoded), MAGIC))
+    os.replace(tmp_filename, filename)
+    return footer
+
+
+class Segment:
+    """Read-only view of a segment file through a memory mapping."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_length, magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+        if magic != MAGIC or self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError(f"{filename} is not a sales segment")
+        footer_end = len(self.map) - TRAILER.size
+        self.footer = json.loads(self.map[footer_end - footer_length:footer_end])
+        self.binary = set(self.footer["binary"])
+        self.odd = {name: {int(i): value for i, value in values.items()} for name, values in self.footer["odd"].items()}
+        self.int64 = struct.Struct("<q" if self.footer["byteorder"] == "little" else ">q")
+
+    def __len__(self):
+        return self.footer["rows"]
+
+    def close(self):
+        self.map.close()
+
+    def _block(self, name: str):
+        offset, length = self.footer["columns"][name]
+        return memoryview(self.map)[offset:offset + length]
+
+    def _array(self, name: str, typecode: str):
+        block = self._block(name)
+        if self.footer["byteorder"] == sys.byteorder:
+            return block.cast(typecode)
+        values = array(typecode, block)
+        values.byteswap()
+        return values
+
+    def timestamps(self):
+        return self._array("timestamp", "q")
+
+    def buyer_codes(self):
+        return self._array("buyer", "I")
+
+    def token_codes(self):
+        return self._array("token", "B")
+
+    def units(self):
+        """Each row's realPrice as (high, low) int64 arrays: high * AMOUNT_SPLIT + low."""
+        return self._array("units_hi", "q"), self._array("units_lo", "q")
+
+    def real_price(self, i: int):
+        """Row i's realPrice, in base units."""
+        hi_offset, _ = self.footer["columns"]["units_hi"]
+        lo_offset, _ = self.footer["columns"]["units_lo"]
+        (hi,) = self.int64.unpack_from(self.map, hi_offset + 8 * i)
+        (lo,) = self.int64.unpack_from(self.map, lo_offset + 8 * i)
+        return hi * AMOUNT_SPLIT + lo
+
+    def value(self, name: str, i: int):
+        """Row i of a fixed-width column: txHash, realPrice, or entry i of buyers."""
+        if name == "realPrice":
+            return str(self.real_price(i))
+        offset, _ = self.footer["columns"][name]
+        width = self.footer["widths"][name]
+        data = self.map[offset + i * width:offset + (i + 1) * width]
+        if name in self.binary:
+            odd = self.odd.get(name)
+            return odd[i] if odd and i in odd else "0x" + data.hex()
+        return data.rstrip(b"\0").decode()
+
+    def values(self, name: str, indices):
+        """A text column at the given row indices, in that order.
+
+        Compressed columns are inflated a block at a time as the indices reach
+        it, so ascending indices inflate each block once.
+        """
+        if name == "realPrice":
+            units_hi, units_lo = self.units()
+            return [str(units_hi[i] * AMOUNT_SPLIT + units_lo[i]) for i in indices]
+        if name in self.footer["widths"]:
+            if isinstance(indices, range) and indices.step == 1:
+                # A run of rows is a single slice.
+                offset, _ = self.footer["columns"][name]
+                width = self.footer["widths"][name]
+                data = self.map[offset + indices.start * width:offset + indices.stop * width]
+                if name not in self.binary:
+                    return [data[i:i + width].rstrip(b"\0").decode() for i in range(0, len(data), width)] if width else [""] * len(indices)
+                odd = self.odd.get(name, {})
+                return [odd[row] if row in odd else "0x" + data[i:i + width].hex() for row, i in zip(indices, range(0, len(data), width))]
+            return [self.value(name, i) for i in indices]
+        offset, _ = self.footer["columns"][name]
+        ends, block_rows = self.footer["blocks"][name], self.footer["block_rows"]
+        values, current, block = [], None, None
+        for i in indices:
+            if i // block_rows != current:
+                current = i // block_rows
+                start = offset + (ends[current - 1] if current else 0)
+                block = zlib.decompress(self.map[start:offset + ends[current]]).decode().split("\n")
+            values.append(block[i % block_rows])
+        return values
+
+    def buyer(self, code: int):
+        return self.value("buyers", code)
+
+    def between(self, since: int = None, until: int = None):
+        """Row indices [start, stop) with since <= timestamp < until."""
+        timestamps = self.timestamps()
+        # Rows are newest first, so search the negated timestamps.
+        negated = _Negated(timestamps)
+        start = 0 if until is None else bisect_left(negated, -until + 1)
+        stop = len(timestamps) if since is None else bisect_left(negated, -since + 1)
+        return start, stop
+
+    def find_tx(self, tx_hash: str):
+        """The last row of a transaction, None if it is not in this segment."""
+        tx_order = self._array("tx_order", "I")
+        i = bisect_right(tx_order, tx_hash, key=lambda row: self.value("txHash", row))
+        if i == 0 or self.value("txHash", tx_order[i - 1]) != tx_hash:
+            return None
+        return tx_order[i - 1]
+
+    def after(self, since: int = None, tx_hash: str = None):
+        """Row indices newer than a timestamp or a txHash, newest first.
+
+        An unknown txHash, such as one from another week, matches every row.
+        """
+        if tx_hash is None:
+            _, stop = self.between(since=since + 1)
+            return range(0, stop)
+        row = self.find_tx(tx_hash)
+        if row is None:
+            return range(0, len(self))
+        timestamp = self.timestamps()[row]
+        _, newer = self.between(since=timestamp + 1)
+        _, tied = self.between(since=timestamp)
+        return [*range(0, newer), *range(row + 1, tied)]
+
+    def postings(self, name: str, key: str):
+        """Ascending row indices of a buyer (lowercase address) or an asset id.
+
+        name is "buyer" or "asset"; asset ids are taken without the "<n>x"
+        quantity suffix some collections add.
+        """
+        starts = self._array(f"{name}_starts", "I")
+        keys = _Fixed(self, f"{name}_keys", len(starts) - 1)
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return ()
+        return self._array(f"{name}_rows", "I")[starts[i]:starts[i + 1]]
+
+    def posting_items(self, name: str):
+        """(key, ascending row indices) for every buyer or asset id, by key."""
+        starts, rows = self._array(f"{name}_starts", "I"), self._array(f"{name}_rows", "I")
+        for i in range(len(starts) - 1):
+            yield self.value(f"{name}_keys", i), rows[starts[i]:starts[i + 1]]
+
+    def rows(self, start: int = 0, stop: int = None):
+        """CSV rows, in footer["header"] order, for row indices [start, stop)."""
+        stop = len(self) if stop is None else stop
+        return self.rows_at(range(start, stop))
+
+    def rows_at(self, indices):
+        """CSV rows for the given row indices, best ascending."""
+        if not isinstance(indices, range):
+            indices = list(indices)
+        symbols = self.footer["token_symbols"]
+        timestamps, buyer_codes, token_codes = self.timestamps(), self.buyer_codes(), self.token_codes()
+        assets, prices, tx_hashes, real_prices = (self.values(name, indices) for name in ("asset", "price", "txHash", "realPrice"))
+        extra = [self.values(f"extra:{column}", indices) for column in self.footer["header"][7:]]
+        buyers = {}
+        rows = []
+        for n, i in enumerate(indices):
+            code = buyer_codes[i]
+            if code not in buyers:
+                buyers[code] = self.buyer(code)
+            rows.append([buyers[code], assets[n], prices[n], tx_hashes[n], timestamps[i], real_prices[n], symbols[token_codes[i]],
+                         *(values[n] for values in extra)])
+        return rows
+
+    def iter_csv(self, start: int = 0, stop: int = None, chunk_rows: int = BLOCK_ROWS):
+        """The rows as CSV text, header first, encoded a chunk of rows at a time."""
+        stop = len(self) if stop is None else stop
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.footer["header"])
+        for chunk_start in range(start, stop, chunk_rows):
+            writer.writerows(self.rows(chunk_start, min(chunk_start + chunk_rows, stop)))
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    def to_csv(self, start: int = 0, stop: int = None) -> bytes:
+        return b"".join(self.iter_csv(start, stop))
+
+
+class _Fixed:
+    # A fixed-width column as a sequence, for bisect.
+    def __init__(self, segment: Segment, name: str, length: int):
+        self.segment, self.name, self.length = segment, name, length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.segment.value(self.name, i)
+
+
+class _Negated:
+    # bisect needs an ascending sequence; this presents a descending one as such.
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return -self.values[i]
@@ -0,0 +1,286 @@
+import gzip
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import HTTPException, Response
+from starlette.responses import StreamingResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Files up to CACHED_BODY_LIMIT are answered from an LRU of bodies keyed on
+# their version, so repeat downloads of a hot week skip the disk; anything
+# bigger is streamed.
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+CACHED_BODY_LIMIT = 8 * 1024 * 1024
+
+# Closed weeks never change; everything else must be revalidated, which is a
+# 304 while the ETag still matches.
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Preferred first. Closed weeks keep a compressed copy next to the CSV under
+# the suffix; the live week's compressed body is cached per version instead,
+# or compressed as it is streamed once it is too big to cache.
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+class BodyCache:
+    """Bounded LRU of response bodies, each stored with the ETag it was read at.
+
+    A writer publishing a new version changes the ETag, so the stale body is
+    never returned and is replaced on the next read.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        # Filled from worker threads.
+        self.lock = threading.Lock()
+
+    def get(self, key, etag: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = (etag, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+BODY_CACHE = BodyCache(RESPONSE_CACHE_BYTES)
+
+
+def file_validators(stat):
+    """(ETag, Last-Modified) for a file, from its inode, size and mtime."""
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return etag, formatdate(stat.st_mtime, usegmt=True)
+
+
+def not_modified(request_headers, etag: str, last_modified: str = None):
+    if request_headers is None:
+        return False
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, last_modified: str = None, immutable: bool = False):
+    headers = {'ETag': etag, 'Cache-Control': IMMUTABLE if immutable else REVALIDATE}
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return headers
+
+
+def parse_range(range_header: str, size: int):
+    """(start, end) inclusive for a single "bytes=" range, None to send it all.
+
+    Multi-range requests are answered with the whole file, which HTTP allows.
+    """
+    match = _RANGE.match(range_header.strip()) if range_header else None
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def accepted_encoding(request_headers):
+    """The preferred encoding the client accepts, None for identity."""
+    header = request_headers.get("accept-encoding") if request_headers else None
+    if not header:
+        return None
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding == "br" and brotli is None:
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False):
+    # Precompressed copies are made once, so they get the slow settings;
+    # live bodies are recompressed every version and stay fast.
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+
+def precompress(filename: str):
+    """Write <filename>.gz (and .br when brotli is installed) unless current.
+
+    Only for files that no longer change, such as closed weeks.
+    """
+    source_mtime = os.stat(filename).st_mtime_ns
+    body = None
+    for encoding, suffix in ENCODINGS.items():
+        if encoding == "br" and brotli is None:
+            continue
+        variant = filename + suffix
+        if os.path.exists(variant) and os.stat(variant).st_mtime_ns >= source_mtime:
+            continue
+        if body is None:
+            with open(filename, 'rb') as f:
+                body = f.read()
+        # Two downloads may race to create the same copy; each writes its own.
+        tmp_filename = f"{variant}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(compress(body, encoding, best=True))
+        os.replace(tmp_filename, variant)
+
+
+def representation_etag(etag: str, encoding: str = None):
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def _read_chunks(f, remaining: int):
+    try:
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _compress_chunks(f, encoding: str):
+    # The live week's compressed body, produced as it is sent.
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            compressed = process(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+    finally:
+        f.close()
+
+
+def _send_file(f, size: int, cache_key, etag: str, headers: dict, byte_range, media_type: str):
+    start, end = byte_range if byte_range is not None else (0, size - 1)
+    status_code = 200
+    if byte_range is not None:
+        status_code = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    if size <= CACHED_BODY_LIMIT:
+        body = BODY_CACHE.get(cache_key, etag)
+        if body is None:
+            with f:
+                body = f.read()
+            BODY_CACHE.put(cache_key, etag, body)
+        else:
+            f.close()
+        content = body if byte_range is None else body[start:end + 1]
+        return Response(content=content, status_code=status_code, media_type=media_type, headers=headers)
+
+    f.seek(start)
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(_read_chunks(f, end - start + 1), status_code=status_code, media_type=media_type, headers=headers)
+
+
+def file_response(filename: str, request_headers=None, media_type: str = "text/csv", download_name: str = None, immutable: bool = False):
+    """Answer a download of a file: 304, a cached body, or a chunked stream.
+
+    The file is opened here and its version taken from the open handle, so a
+    writer that swaps in a new version with os.replace mid-download cannot
+    change what this response sends. A single byte range is honoured, on the
+    uncompressed file only. Open it from a worker thread.
+    """
+    f = open(filename, 'rb')
+    try:
+        stat = os.fstat(f.fileno())
+        etag, last_modified = file_validators(stat)
+        range_header = request_headers.get("range") if request_headers else None
+        encoding = None if range_header else accepted_encoding(request_headers)
+        headers = cache_headers(representation_etag(etag, encoding), last_modified, immutable)
+        headers['Vary'] = 'Accept-Encoding'
+        if not_modified(request_headers, headers['ETag'], last_modified):
+            f.close()
+            return Response(status_code=304, headers=headers)
+        size = stat.st_size
+        byte_range = parse_range(range_header, size)
+    except Exception:
+        f.close()
+        raise
+
+    headers['Content-Disposition'] = f'attachment; filename={download_name or os.path.basename(filename)}'
+    if encoding is None:
+        headers['Accept-Ranges'] = 'bytes'
+        return _send_file(f, size, filename, etag, headers, byte_range, media_type)
+
+    headers['Content-Encoding'] = encoding
+    if immutable:
+        f.close()
+        precompress(filename)
+        variant = filename + ENCODINGS[encoding]
+        f = open(variant, 'rb')
+        return _send_file(f, os.fstat(f.fileno()).st_size, variant, etag, headers, None, media_type)
+
+    if size > CACHED_BODY_LIMIT:
+        return StreamingResponse(_compress_chunks(f, encoding), media_type=media_type, headers=headers)
+    body = BODY_CACHE.get((filename, encoding), etag)
+    if body is None:
+        with f:
+            body = compress(f.read(), encoding)
+        BODY_CACHE.put((filename, encoding), etag, body)
+    else:
+        f.close()
+    return Response(content=body, media_type=media_type, headers=headers)
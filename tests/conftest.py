@@ -0,0 +1,95 @@
+import csv
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to tracker.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sales import Asset, Sale
+
+HEADER = ["buyer", "lords_id", "price", "txHash", "timestamp", "realPrice", "token"]
+TOKEN_DECIMALS = {"WETH": 18, "USDC": 6}
+
+
+def sale(n: int, timestamp: int, buyer: str = None, asset_id: str = None, token: str = "WETH", units: int = None):
+    """A buyers log row; realPrice defaults to n whole tokens."""
+    units = n * 10 ** TOKEN_DECIMALS[token] if units is None else units
+    amount = units / 10 ** TOKEN_DECIMALS[token]
+    return [buyer or f"0xBuyer{n % 3}", asset_id or str(n), f"{amount:g} {token}", f"0xtx{n}", str(timestamp), str(units), token]
+
+
+@pytest.fixture
+def write_log(tmp_path):
+    """Write rows, in the given (append) order, to a buyers log and return its path."""
+    def write(rows, name="log.csv"):
+        filename = str(tmp_path / name)
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        return filename
+    return write
+
+
+WETH = "0xc99a6a985ed2cac1ef41640596c5a5f9f4e19ef5"
+
+
+class FakeMarket:
+    """Stands in for the marketplace API: sales per collection, newest first.
+
+    Offsets listed in failures come back as failed requests, the way
+    fetch_transactions reports them.
+    """
+
+    def __init__(self):
+        self.sales = {}
+        self.failures = set()
+        self.requests = []
+
+    def sale(self, n: int, timestamp: int, order_id=None, quantity: int = 1, tx_hash: str = None):
+        return Sale(maker=f"0x{n % 5:040x}", paymentToken=WETH, realPrice=str(10 ** 18 + n), timestamp=timestamp,
+                    txHash=tx_hash or f"0x{n:064x}", orderKind=0, quantity=quantity,
+                    orderId=n if order_id is None else order_id, assets=[Asset(id=str(100 + n))])
+
+    async def fetch_transactions(self, name, offset, session, stats=None, size=None):
+        self.requests.append((name, offset))
+        if stats is not None:
+            stats["requests"] += 1
+        if offset in self.failures:
+            if stats is not None:
+                stats["errors"] += 1
+            return None
+        if stats is not None:
+            stats["pages"] += 1
+        return self.sales.get(name, [])[offset:offset + size]
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def tracker_env(request, tmp_path, monkeypatch):
+    """The tracker module on either backend, with its state kept in an empty directory."""
+    import buyer_index
+    import manifest
+    import sales_db
+    import tracker
+
+    monkeypatch.chdir(tmp_path)
+    for name in tracker.COLLECTIONS:
+        os.makedirs(f"./{name}_buyers", exist_ok=True)
+    db = sales_db.connect(str(tmp_path / "sales.db")) if request.param == "sqlite" else None
+    monkeypatch.setattr(tracker, "DB", db)
+    monkeypatch.setattr(tracker, "MANIFEST", manifest.WeekManifest(str(tmp_path / "weeks_manifest.json")))
+    monkeypatch.setattr(tracker, "BUYERS", buyer_index.BuyerIndex(str(tmp_path / "buyer_index.json")))
+    for cache in ("_file_locks", "_live_rollups", "_closed_rollups", "_segments", "_sorted_views", "_log_indexes"):
+        monkeypatch.setattr(tracker, cache, type(getattr(tracker, cache))())
+    yield tracker
+    if db is not None:
+        db.close()
+
+
+@pytest.fixture
+def market(tracker_env, monkeypatch):
+    market = FakeMarket()
+    monkeypatch.setattr(tracker_env, "fetch_transactions", market.fetch_transactions)
+    return market
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+import aggregate
+import segments
+from conftest import HEADER, TOKEN_DECIMALS, sale
+
+
+def brute_force(rows):
+    totals = {}
+    for row in rows:
+        tokens = totals.setdefault(row[0], {})
+        tokens[row[6]] = tokens.get(row[6], 0) + int(row[5])
+    return totals
+
+
+@pytest.mark.parametrize("largest", [10 ** 24, 10 ** 27])
+def test_buyer_token_totals_match_the_rows(tmp_path, largest):
+    # Sales of up to 10 ** 27 base units add up past what the int64 halves hold.
+    rng = random.Random(largest)
+    rows = [sale(n, 1000 + n // 3, buyer=f"0xBuyer{rng.randrange(7)}", token=rng.choice(["WETH", "USDC"]), units=rng.randrange(largest))
+            for n in range(3000)]
+    filename = str(tmp_path / "week.seg")
+    segments.write_segment(filename, HEADER, rows, TOKEN_DECIMALS)
+    segment = segments.Segment(filename)
+    try:
+        assert aggregate.buyer_token_totals(segment) == brute_force(rows)
+    finally:
+        # Fails if anything returned still holds on to the mapping.
+        segment.close()
+
+
+def test_buyer_token_totals_of_an_empty_week(tmp_path):
+    filename = str(tmp_path / "week.seg")
+    segments.write_segment(filename, HEADER, [], TOKEN_DECIMALS)
+    segment = segments.Segment(filename)
+    assert aggregate.buyer_token_totals(segment) == {}
+    segment.close()
@@ -0,0 +1,93 @@
+import csv
+
+import pytest
+
+import log_index
+import sales_db
+import segments
+from conftest import HEADER, TOKEN_DECIMALS, sale
+
+# Appended out of time order, with ties on 200 and 300 split across pages,
+# the way a backfill interleaves with polls.
+ROWS = [
+    sale(1, 300), sale(2, 200), sale(3, 100),
+    sale(4, 300), sale(5, 200), sale(6, 400), sale(7, 200),
+]
+
+
+def tx_hashes(rows):
+    return [row[3] for row in rows]
+
+
+@pytest.fixture
+def sources(tmp_path, write_log):
+    """tx_hash order of the rows after a cursor, from each of the three stores."""
+    index = log_index.LogIndex(write_log(ROWS))
+    index.refresh()
+
+    segment_filename = str(tmp_path / "week.seg")
+    segments.write_segment(segment_filename, HEADER, ROWS, TOKEN_DECIMALS)
+    segment = segments.Segment(segment_filename)
+
+    connection = sales_db.connect(":memory:")
+    table = sales_db.SaleTable(connection, "lords", 0, 1000, TOKEN_DECIMALS, lambda units, token: f"{units} {token}")
+    for row in ROWS:
+        table.add(f"{row[3]}_{row[1]}", row[0], row[1], row[3], int(row[4]), int(row[5]), row[6])
+    table.write([f"{row[3]}_{row[1]}" for row in ROWS])
+    connection.commit()
+
+    def from_log(since=None, tx_hash=None):
+        return tx_hashes(index.read_rows(index.after(since, tx_hash)))
+
+    def from_segment(since=None, tx_hash=None):
+        return tx_hashes(segment.rows_at(segment.after(since, tx_hash)))
+
+    def from_db(since=None, tx_hash=None):
+        return [row[4] for row in sales_db.rows_after(connection, "lords", 0, 1000, since, tx_hash)]
+
+    yield {"log": from_log, "segment": from_segment, "db": from_db}
+    segment.close()
+    connection.close()
+
+
+def test_whole_week_is_newest_first_with_ties_in_log_order(sources):
+    expected = ["0xtx6", "0xtx1", "0xtx4", "0xtx2", "0xtx5", "0xtx7", "0xtx3"]
+    for name, after in sources.items():
+        assert after(since=0) == expected, name
+
+
+@pytest.mark.parametrize("since, expected", [
+    (100, ["0xtx6", "0xtx1", "0xtx4", "0xtx2", "0xtx5", "0xtx7"]),
+    # A timestamp cursor excludes the whole tie on it.
+    (200, ["0xtx6", "0xtx1", "0xtx4"]),
+    (400, []),
+])
+def test_timestamp_cursor(sources, since, expected):
+    for name, after in sources.items():
+        assert after(since=since) == expected, name
+
+
+@pytest.mark.parametrize("tx_hash, expected", [
+    # Within a tie, a txHash cursor resumes after its own row in log order.
+    ("0xtx2", ["0xtx6", "0xtx1", "0xtx4", "0xtx5", "0xtx7"]),
+    ("0xtx5", ["0xtx6", "0xtx1", "0xtx4", "0xtx7"]),
+    ("0xtx7", ["0xtx6", "0xtx1", "0xtx4"]),
+    ("0xtx1", ["0xtx6", "0xtx4"]),
+    ("0xtx6", []),
+    # An unknown txHash, such as one from another week, matches everything.
+    ("0xnope", ["0xtx6", "0xtx1", "0xtx4", "0xtx2", "0xtx5", "0xtx7", "0xtx3"]),
+])
+def test_tx_hash_cursor(sources, tx_hash, expected):
+    for name, after in sources.items():
+        assert after(tx_hash=tx_hash) == expected, name
+
+
+def test_log_index_picks_up_appended_pages(write_log):
+    filename = write_log(ROWS[:3])
+    index = log_index.LogIndex(filename)
+    index.refresh()
+    with open(filename, "a", newline="") as f:
+        csv.writer(f).writerows(ROWS[3:])
+    index.refresh()
+    assert tx_hashes(index.read_rows(index.after(since=0))) == ["0xtx6", "0xtx1", "0xtx4", "0xtx2", "0xtx5", "0xtx7", "0xtx3"]
+    assert list(index.newest_first(200, 400)) == [0, 3, 1, 4, 6]
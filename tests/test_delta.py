@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from test_ingestion import run, run_previous_week, start
+
+
+def delta(tracker, week_start, since):
+    response = run(tracker.serve_delta("lords", week_start, since, "ndjson"))
+    records = [json.loads(line) for line in response.body.decode().splitlines()]
+    return [record["txHash"] for record in records], response.headers["X-Cursor"]
+
+
+def poll(tracker, state):
+    state["last_timestamp"] = run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None))
+
+
+def test_since_returns_only_what_was_ingested_after_the_cursor(tracker_env, market):
+    tracker = tracker_env
+    state, week_start, _ = start(tracker)
+    sales = [market.sale(1, week_start + 30), market.sale(2, week_start + 20), market.sale(3, week_start + 10)]
+    market.sales["lords"] = sales
+    poll(tracker, state)
+
+    tx_hashes, cursor = delta(tracker, week_start, "0")
+    assert tx_hashes == [sale.txHash for sale in sales]
+    assert cursor == sales[0].txHash
+
+    # One more sale in the newest second, and a newer one.
+    newer = [market.sale(4, week_start + 40), market.sale(5, week_start + 30)]
+    market.sales["lords"] = newer + sales
+    poll(tracker, state)
+    tx_hashes, next_cursor = delta(tracker, week_start, cursor)
+    assert tx_hashes == [newer[0].txHash, newer[1].txHash]
+    assert next_cursor == newer[0].txHash
+    assert delta(tracker, week_start, next_cursor) == ([], next_cursor)
+
+    # A timestamp cursor leaves out the whole second it names.
+    assert delta(tracker, week_start, str(week_start + 30))[0] == [newer[0].txHash]
+
+
+def test_since_on_a_closed_week(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    current, _ = tracker.get_week_timestamps()
+    sales = [market.sale(1, current - 10), market.sale(2, current - 20), market.sale(3, current - 30)]
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, sales)
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert tracker.MANIFEST.is_closed("lords", previous)
+
+    assert delta(tracker, previous, sales[2].txHash) == ([sales[0].txHash, sales[1].txHash], sales[0].txHash)
+    # A txHash from another week returns the whole week.
+    assert delta(tracker, previous, "0xnope")[0] == [sale.txHash for sale in sales]
+
+
+@pytest.mark.parametrize("week_offset, response_format, status", [(0, "xml", 400), (-50, "ndjson", 404)])
+def test_since_errors(tracker_env, week_offset, response_format, status):
+    tracker = tracker_env
+    _, week_start, _ = start(tracker)
+    with pytest.raises(HTTPException) as raised:
+        run(tracker.serve_delta("lords", week_start + week_offset * 7 * 24 * 60 * 60, "0", response_format))
+    assert raised.value.status_code == status
@@ -0,0 +1,303 @@
+import asyncio
+import csv
+import errno
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from sales import page_decoder
+
+WEEK = 7 * 24 * 60 * 60
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def start(tracker, name="lords"):
+    state = run(tracker.start_week(name))
+    return state, state["week_start"], state["week_end"]
+
+
+def run_previous_week(tracker, market, monkeypatch, sales, name="lords"):
+    """Start and poll the week before the current one, as if it had not ended yet."""
+    current, _ = tracker.get_week_timestamps()
+    market.sales[name] = sales
+    with monkeypatch.context() as patch:
+        patch.setattr(tracker, "get_week_timestamps", lambda: (current - WEEK, current))
+        state = run(tracker.start_week(name))
+        state["checkpoint"]["backfill_complete"] = True
+        state["last_timestamp"] = run(tracker.poll_new_transactions(
+            name, state["store"], state["last_timestamp"], None, state["checkpoint"]
+        ))
+    return state, current - WEEK, current
+
+
+def closed_week_timestamps(tracker, week_start, name="lords"):
+    segment = tracker.open_segment(f"./{name}_buyers/{name}_buyers_{week_start}.seg")
+    return sorted(segment.timestamps().tolist())
+
+
+@pytest.mark.parametrize("body", [b'{"data": null}', b'{"data": {"recentlySolds": null}}', b'{"data": {"recentlySolds": {}}}'])
+def test_a_response_without_results_does_not_end_the_backfill(tracker_env, monkeypatch, body):
+    async def post_query(label, payload, session, decoder, stats=None):
+        return page_decoder.decode(body)
+
+    monkeypatch.setattr(tracker_env, "post_query", post_query)
+    state, _, _ = start(tracker_env)
+    stats = tracker_env.new_fetch_stats()
+    assert run(tracker_env.fetch_transactions("lords", 0, None, stats)) is None
+    assert stats["errors"] == 1
+
+    run(tracker_env.historical_backfill("lords", state["store"], None, state["checkpoint"]))
+    assert not state["checkpoint"]["backfill_complete"]
+    assert not tracker_env.load_checkpoint("lords", state["week_start"])["backfill_complete"]
+
+
+def test_an_empty_page_ends_the_backfill(tracker_env, monkeypatch):
+    async def post_query(label, payload, session, decoder, stats=None):
+        return page_decoder.decode(b'{"data": {"recentlySolds": {"results": []}}}')
+
+    monkeypatch.setattr(tracker_env, "post_query", post_query)
+    state, _, _ = start(tracker_env)
+    assert run(tracker_env.fetch_transactions("lords", 0, None)) == []
+    run(tracker_env.historical_backfill("lords", state["store"], None, state["checkpoint"]))
+    assert state["checkpoint"]["backfill_complete"]
+
+
+def week_timestamps(tracker, week_start, name="lords"):
+    """Timestamps of a week's sales, from its log or the database."""
+    if tracker.DB is not None:
+        rows = tracker.sales_db.week_rows(tracker.DB, name, week_start, week_start + WEEK)
+        return sorted(row[5] for row in rows)
+    index = tracker.open_week_index(name, week_start)
+    return sorted(index.timestamps.tolist())
+
+
+def test_final_poll_before_closing_the_week(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [])
+    market.sales["lords"] = [market.sale(1, current - 500)]
+    with monkeypatch.context() as patch:
+        patch.setattr(tracker, "get_week_timestamps", lambda: (previous, current))
+        state["last_timestamp"] = run(tracker.poll_new_transactions(
+            "lords", state["store"], state["last_timestamp"], None, state["checkpoint"]
+        ))
+
+    # Sold after that poll: two in the ending week, one in the new one.
+    market.sales["lords"] = [market.sale(2, current + 20), market.sale(3, current - 3), market.sale(4, current - 4)] + market.sales["lords"]
+
+    # A failed final poll leaves the week open.
+    market.failures.add(0)
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert state["week_start"] == previous
+    assert not tracker.MANIFEST.is_closed("lords", previous)
+
+    market.failures.clear()
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert state["week_start"] == current
+    assert tracker.MANIFEST.is_closed("lords", previous)
+    assert closed_week_timestamps(tracker, previous) == [current - 500, current - 4, current - 3]
+    assert week_timestamps(tracker, current) == [current + 20]
+
+
+def test_closing_a_week_writes_its_segment_off_the_event_loop(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    current, _ = tracker.get_week_timestamps()
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [market.sale(1, current - 100)])
+    threads = {}
+
+    def recorded(label, func):
+        def call(*args, **kwargs):
+            threads.setdefault(label, set()).add(threading.get_ident())
+            return func(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(tracker.segments, "write_segment", recorded("segment", tracker.segments.write_segment))
+    if tracker.DB is not None:
+        monkeypatch.setattr(tracker, "db_week_csv_rows", recorded("rows", tracker.db_week_csv_rows))
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert tracker.MANIFEST.is_closed("lords", previous)
+    assert threading.get_ident() not in threads["segment"]
+    if tracker.DB is not None:
+        # The SQLite connection is only used from the event loop thread.
+        assert threads["rows"] == {threading.get_ident()}
+
+
+class FailingCommit:
+    """The tracker's connection, with the next commit failing once fail is set."""
+
+    def __init__(self, connection, failed):
+        self.connection, self.failed = connection, failed
+        self.fail = False
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def commit(self):
+        if self.fail:
+            self.fail = False
+            self.failed.set()
+            raise sqlite3.OperationalError("disk I/O error")
+        self.connection.commit()
+
+
+def test_a_failed_commit_leaves_other_collections_sales_alone(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    if tracker.DB is None:
+        pytest.skip("each collection appends to a log of its own")
+    monkeypatch.setattr(tracker, "POLL_PAGE_SIZE", 2)
+    lords, week_start, _ = start(tracker, "lords")
+    packs, _, _ = start(tracker, "packs")
+    market.sales["lords"] = [market.sale(n, week_start + 20 - n) for n in range(3)]
+    market.sales["packs"] = [market.sale(7, week_start + 30)]
+
+    failed = asyncio.Event()
+    connection = FailingCommit(tracker.DB, failed)
+    monkeypatch.setattr(tracker, "DB", connection)
+    fetch = market.fetch_transactions
+
+    async def fetch_transactions(name, offset, session, stats=None, size=None):
+        if name == "lords" and offset:
+            # lords' first page is stored meanwhile, waiting on its second.
+            await failed.wait()
+        return await fetch(name, offset, session, stats, size)
+
+    monkeypatch.setattr(tracker, "fetch_transactions", fetch_transactions)
+
+    async def poll(*states):
+        return await asyncio.gather(*(
+            tracker.poll_new_transactions(name, state["store"], state["last_timestamp"], None, state["checkpoint"])
+            for name, state in states
+        ), return_exceptions=True)
+
+    connection.fail = True
+    results = run(poll(("lords", lords), ("packs", packs)))
+    assert isinstance(results[1], sqlite3.OperationalError)
+    assert results[0] == week_start + 20
+    assert week_timestamps(tracker, week_start, "lords") == [week_start + 18, week_start + 19, week_start + 20]
+    assert week_timestamps(tracker, week_start, "packs") == []
+
+    # The failed page was forgotten, so the next poll stores it.
+    assert run(poll(("packs", packs))) == [week_start + 30]
+    assert week_timestamps(tracker, week_start, "packs") == [week_start + 30]
+
+
+def test_poll_stops_below_the_watermark_second(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    monkeypatch.setattr(tracker, "POLL_PAGE_SIZE", 2)
+    state, week_start, _ = start(tracker)
+    older = [market.sale(n, week_start + 40 - n) for n in range(10, 20)]
+    market.sales["lords"] = [market.sale(1, week_start + 50), market.sale(2, week_start + 40)] + older
+    state["last_timestamp"] = run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None))
+    assert state["last_timestamp"] == week_start + 50
+
+    # Sold in the watermark's second after the last poll, listed above the
+    # sale already stored from it.
+    market.sales["lords"] = [market.sale(3, week_start + 60), market.sale(4, week_start + 50)] + market.sales["lords"]
+    market.requests.clear()
+    assert run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None)) == week_start + 60
+    assert week_timestamps(tracker, week_start) == sorted(sale.timestamp for sale in market.sales["lords"])
+    # The tie is read to its end, and nothing older than it.
+    assert market.requests == [("lords", 0), ("lords", 2)]
+
+
+def test_closing_a_week_removes_its_sorted_view(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    if tracker.DB is not None:
+        pytest.skip("the database serves the live week without a copy")
+    current, _ = tracker.get_week_timestamps()
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [market.sale(1, current - 100)])
+    view_filename = tracker.write_sorted_view(*tracker.snapshot_sorted_view(state["filename"]))
+    assert os.path.exists(view_filename)
+
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert tracker.MANIFEST.is_closed("lords", previous)
+    assert not os.path.exists(view_filename)
+    assert tracker._sorted_views == {}
+
+
+def test_a_failed_append_is_cut_off_and_fetched_again(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    if tracker.DB is not None:
+        pytest.skip("a failed commit writes nothing")
+    state, week_start, _ = start(tracker)
+    market.sales["lords"] = [market.sale(1, week_start + 10)]
+    state["last_timestamp"] = run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None, state["checkpoint"]))
+    size = os.path.getsize(state["filename"])
+    checkpoint = dict(state["checkpoint"])
+
+    def failing_open(filename, mode="r", *args, **kwargs):
+        f = open(filename, mode, *args, **kwargs)
+        if mode == "a":
+            write = f.write
+
+            def partial_write(data):
+                # Half the page reaches the disk before it fills up.
+                write(data[:len(data) // 2])
+                f.flush()
+                raise OSError(errno.ENOSPC, "No space left on device")
+            f.write = partial_write
+        return f
+
+    market.sales["lords"] = [market.sale(2, week_start + 30), market.sale(3, week_start + 20)] + market.sales["lords"]
+    with monkeypatch.context() as patch:
+        patch.setattr(tracker, "open", failing_open, raising=False)
+        with pytest.raises(OSError):
+            run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None, state["checkpoint"]))
+    assert os.path.getsize(state["filename"]) == size
+    assert state["checkpoint"] == checkpoint
+
+    # The store forgot the page, so the next poll appends it whole.
+    assert run(tracker.poll_new_transactions("lords", state["store"], state["last_timestamp"], None, state["checkpoint"])) == week_start + 30
+    with open(state["filename"], newline='') as f:
+        assert sorted(int(row["timestamp"]) for row in csv.DictReader(f)) == [week_start + 10, week_start + 20, week_start + 30]
+    assert state["checkpoint"]["last_timestamp"] == week_start + 30
+
+
+def test_start_removes_the_sorted_views_of_past_weeks(tracker_env):
+    tracker = tracker_env
+    if tracker.DB is not None:
+        pytest.skip("the database serves the live week without a copy")
+    current, _ = tracker.get_week_timestamps()
+    stale = f"./lords_buyers/.lords_buyers_{current - WEEK}.sorted.csv"
+    with open(stale, "w") as f:
+        f.write("buyer\n")
+    start(tracker)
+    assert not os.path.exists(stale)
+
+
+def test_a_restart_resumes_from_the_checkpoint(tracker_env, market, monkeypatch):
+    tracker = tracker_env
+    monkeypatch.setattr(tracker, "BACKFILL_PAGE_SIZE", 2)
+    monkeypatch.setattr(tracker, "BACKFILL_CONCURRENCY", 1)
+    state, week_start, _ = start(tracker)
+    market.sales["lords"] = [market.sale(n, week_start + 100 - n) for n in range(8)]
+
+    # Interrupted at its third page.
+    market.failures.add(4)
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert not state["checkpoint"]["backfill_complete"]
+    assert state["checkpoint"]["backfill_offset"] == 4
+
+    # A restart carries on from there rather than from the newest page.
+    market.failures.clear()
+    market.requests.clear()
+    state, _, _ = start(tracker)
+    assert state["checkpoint"]["backfill_offset"] == 4
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert market.requests[0] == ("lords", 4)
+    assert state["checkpoint"]["backfill_complete"]
+    assert week_timestamps(tracker, week_start) == sorted(sale.timestamp for sale in market.sales["lords"])
+
+    # Once backfilled, a restart only fetches the sales made since.
+    market.sales["lords"] = [market.sale(20, week_start + 200)] + market.sales["lords"]
+    market.requests.clear()
+    state, _, _ = start(tracker)
+    assert state["last_timestamp"] == week_start + 100
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert market.requests == [("lords", 0)]
+    assert state["last_timestamp"] == week_start + 200
+    assert len(week_timestamps(tracker, week_start)) == 9
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import rollups
+from rollups import HOUR, WEEK
+
+# The tracker's first week, Monday 2025-02-10 13:00 UTC, and the next.
+FIRST = 1739192400
+WEEKS = [FIRST, FIRST + WEEK]
+
+
+def make_sales():
+    rng = random.Random(7)
+    sales = []
+    for week_start in WEEKS:
+        # Both sides of every hour boundary a query below is cut at.
+        for hour in (0, 1, 2, 50, 167):
+            for offset in (0, 1, HOUR // 2, HOUR - 1):
+                sales.append((week_start + hour * HOUR + offset, f"0x{rng.randrange(4)}", rng.choice(["WETH", "USDC"]), rng.randrange(1, 100)))
+    return sales
+
+
+SALES = make_sales()
+
+
+@pytest.fixture
+def week_rollups():
+    built = {week_start: rollups.WeekRollup(week_start) for week_start in WEEKS}
+    for timestamp, buyer, token, units in SALES:
+        built[timestamp - (timestamp - FIRST) % WEEK].add(timestamp, buyer, token, units)
+    return built
+
+
+def brute_force(start, end, by_buyer=True):
+    bucket = rollups.empty_bucket(by_buyer)
+    for timestamp, buyer, token, units in SALES:
+        if start <= timestamp < end:
+            rollups.add_sale(bucket, buyer, token, units)
+    return bucket
+
+
+def aggregate(week_rollups, start, end, by_buyer=True):
+    scanned = []
+
+    def scan(week_start, since, until):
+        scanned.append((since, until))
+        assert week_start <= since < until <= week_start + WEEK
+        return [sale for sale in SALES if since <= sale[0] < until]
+
+    return rollups.aggregate(WEEKS, start, end, week_rollups.get, scan, by_buyer), scanned
+
+
+@pytest.mark.parametrize("start, end", [
+    (FIRST, FIRST + WEEK),
+    (FIRST - WEEK, FIRST + 3 * WEEK),
+    (FIRST, FIRST + HOUR),
+    (FIRST + 1, FIRST + HOUR - 1),
+    (FIRST + HOUR // 2, FIRST + 2 * HOUR + HOUR // 2),
+    (FIRST + HOUR - 1, FIRST + HOUR + 1),
+    (FIRST + 50 * HOUR + 1, FIRST + WEEK + 2 * HOUR),
+    (FIRST + WEEK - 1, FIRST + WEEK + 1),
+    (FIRST + 167 * HOUR + HOUR // 2, FIRST + WEEK + HOUR // 2),
+])
+@pytest.mark.parametrize("by_buyer", [True, False])
+def test_matches_brute_force(week_rollups, start, end, by_buyer):
+    result, _ = aggregate(week_rollups, start, end, by_buyer)
+    assert result == brute_force(start, end, by_buyer)
+
+
+def test_random_ranges(week_rollups):
+    rng = random.Random(11)
+    for _ in range(200):
+        start = rng.randrange(FIRST - HOUR, FIRST + 2 * WEEK + HOUR)
+        end = start + rng.randrange(1, 3 * HOUR) if rng.random() < 0.5 else rng.randrange(start + 1, FIRST + 2 * WEEK + 2 * HOUR)
+        result, _ = aggregate(week_rollups, start, end)
+        assert result == brute_force(start, end), (start, end)
+
+
+def test_whole_weeks_and_hours_are_not_scanned(week_rollups):
+    _, scanned = aggregate(week_rollups, FIRST - WEEK, FIRST + 3 * WEEK)
+    assert scanned == []
+    _, scanned = aggregate(week_rollups, FIRST + 2 * HOUR, FIRST + 50 * HOUR)
+    assert scanned == []
+
+
+def test_only_partial_hours_are_scanned(week_rollups):
+    _, scanned = aggregate(week_rollups, FIRST + HOUR // 2, FIRST + 2 * HOUR + 10)
+    assert scanned == [(FIRST + HOUR // 2, FIRST + HOUR), (FIRST + 2 * HOUR, FIRST + 2 * HOUR + 10)]
+    # A range inside one hour is a single scan.
+    _, scanned = aggregate(week_rollups, FIRST + 5, FIRST + 10)
+    assert scanned == [(FIRST + 5, FIRST + 10)]
+    # A range across a week boundary is cut at it.
+    _, scanned = aggregate(week_rollups, FIRST + WEEK - 10, FIRST + WEEK + 10)
+    assert scanned == [(FIRST + WEEK - 10, FIRST + WEEK), (FIRST + WEEK, FIRST + WEEK + 10)]
+
+
+def test_weeks_without_a_rollup_are_skipped(week_rollups):
+    del week_rollups[FIRST]
+    result, scanned = aggregate(week_rollups, FIRST + 10, FIRST + WEEK + 10)
+    assert scanned == [(FIRST + WEEK, FIRST + WEEK + 10)]
+    assert result == brute_force(FIRST + WEEK, FIRST + WEEK + 10)
@@ -0,0 +1,116 @@
+import pytest
+
+import log_index
+import sales_query
+import segments
+from conftest import HEADER, TOKEN_DECIMALS, sale
+
+WEEK = 7 * 24 * 60 * 60
+CLOSED, LIVE = 10 * WEEK, 11 * WEEK
+
+
+@pytest.fixture
+def weeks(tmp_path, write_log):
+    """lords: a closed week as a segment and a live log; skins: a live log.
+
+    Timestamps tie within and across collections, so pages have to split
+    ties on the key's collection and position.
+    """
+    closed_rows = [sale(n, CLOSED + 100 + n // 2, asset_id="77" if n % 4 == 0 else None) for n in range(1, 9)]
+    segment_filename = str(tmp_path / "lords_closed.seg")
+    segments.write_segment(segment_filename, HEADER, closed_rows, TOKEN_DECIMALS)
+
+    lords_rows = [sale(n, LIVE + 50 - n % 3) for n in range(10, 16)]
+    skins_rows = [sale(n, LIVE + 50 - n % 4, token="USDC") for n in range(20, 26)]
+    sources = {
+        ("lords", CLOSED): segments.Segment(segment_filename),
+        ("lords", LIVE): log_index.LogIndex(write_log(lords_rows, "lords.csv")),
+        ("skins", LIVE): log_index.LogIndex(write_log(skins_rows, "skins.csv")),
+    }
+    for source in sources.values():
+        if isinstance(source, log_index.LogIndex):
+            source.refresh()
+    yield {"lords": [LIVE, CLOSED], "skins": [LIVE]}, lambda collection, week_start: sources.get((collection, week_start))
+    sources[("lords", CLOSED)].close()
+
+
+def all_pages(weeks, open_week, filters, limit):
+    records, after = [], None
+    while True:
+        previous = after
+        page, after = sales_query.query_files(weeks, open_week, filters, after, limit)
+        assert len(page) <= limit
+        records += page
+        if after is None:
+            return records
+        # Each page has to move the cursor on, or paging never ends.
+        assert previous is None or (-after[0], after[1], after[2]) > (-previous[0], previous[1], previous[2])
+        # The cursor survives its round trip through the URL.
+        after = sales_query.decode_cursor(sales_query.encode_cursor(after))
+
+
+def keys(records):
+    return [(record["collection"], record["txHash"]) for record in records]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"buyer": "0xbuyer1"},
+    {"asset_id": "77"},
+    {"token": "USDC"},
+    {"start": LIVE + 48},
+    {"start": CLOSED + 102, "end": LIVE + 49},
+    {"min_units": sales_query.min_units("12", TOKEN_DECIMALS)},
+])
+@pytest.mark.parametrize("limit", [1, 2, 3, 5])
+def test_pages_add_up_to_one_query(weeks, filters, limit):
+    whole, after = sales_query.query_files(*weeks, filters, limit=1000)
+    assert after is None
+    assert keys(all_pages(*weeks, filters, limit)) == keys(whole)
+
+
+def test_order_is_newest_first_then_collection(weeks):
+    records, _ = sales_query.query_files(*weeks, {}, limit=1000)
+    assert len(records) == 8 + 6 + 6
+    order = [(-record["timestamp"], record["collection"]) for record in records]
+    assert order == sorted(order)
+    # Live ties keep their log order; the segment keeps the log's too.
+    assert keys(records)[:4] == [("lords", "0xtx12"), ("lords", "0xtx15"), ("skins", "0xtx20"), ("skins", "0xtx24")]
+    assert keys(records)[-3:] == [("lords", "0xtx2"), ("lords", "0xtx3"), ("lords", "0xtx1")]
+
+
+def test_filters(weeks):
+    by_buyer, _ = sales_query.query_files(*weeks, {"buyer": "0xbuyer1"}, limit=1000)
+    assert {record["buyer"] for record in by_buyer} == {"0xBuyer1"}
+    assert len(by_buyer) == 3 + 2 + 2
+
+    by_asset, _ = sales_query.query_files(*weeks, {"asset_id": "77"}, limit=1000)
+    assert keys(by_asset) == [("lords", "0xtx8"), ("lords", "0xtx4")]
+
+    # 12 WETH or 12 USDC and up: lords 12-15 and every skins sale.
+    by_price, _ = sales_query.query_files(*weeks, {"min_units": sales_query.min_units("12", TOKEN_DECIMALS)}, limit=1000)
+    assert sorted(keys(by_price)) == sorted([("lords", f"0xtx{n}") for n in range(12, 16)] + [("skins", f"0xtx{n}") for n in range(20, 26)])
+
+
+def test_record_fields(weeks):
+    records, _ = sales_query.query_files(*weeks, {"asset_id": "77"}, limit=1)
+    assert records == [{
+        "collection": "lords", "buyer": "0xBuyer2", "asset_id": "77", "price": "8 WETH", "txHash": "0xtx8",
+        "timestamp": CLOSED + 104, "realPrice": str(8 * 10 ** 18), "token": "WETH",
+    }]
+
+
+@pytest.mark.parametrize("min_price", ["abc", "NaN", "-1", "Infinity", "-Infinity"])
+def test_min_units_rejects(min_price):
+    with pytest.raises(ValueError):
+        sales_query.min_units(min_price, TOKEN_DECIMALS)
+
+
+def test_min_units_rounds_up():
+    assert sales_query.min_units("0.0000001", TOKEN_DECIMALS) == {"WETH": 10 ** 11, "USDC": 1}
+
+
+@pytest.mark.parametrize("cursor", ["zzz", sales_query.encode_cursor(["1", "lords", 2])])
+def test_decode_cursor_rejects(cursor):
+    with pytest.raises(ValueError):
+        sales_query.decode_cursor(cursor)
@@ -0,0 +1,50 @@
+import pytest
+
+import segments
+from conftest import HEADER, TOKEN_DECIMALS
+
+BUYER = "0x" + "ab" * 20
+TX = "0x" + "0f" * 32
+
+
+@pytest.fixture
+def rows():
+    """Rows newest first, so the segment keeps their order.
+
+    Most values are lowercase hex, which is stored as raw bytes; a checksummed
+    address, a short hash and an empty one have to come back unchanged too.
+    """
+    buyers = [BUYER, "0x" + "CD" * 20, "0xBuyer", ""]
+    rows = []
+    for n in range(2000):
+        tx_hash = {7: "0xshort", 8: "", 9: TX.upper()}.get(n, f"0x{n:064x}")
+        rows.append([buyers[n % 4] if n < 12 else BUYER, str(n), "1 WETH", tx_hash, str(5000 - n), str(10 ** 24 + n), "WETH"])
+    return rows
+
+
+def test_rows_come_back_as_written(tmp_path, rows):
+    filename = str(tmp_path / "week.seg")
+    segments.write_segment(filename, HEADER, rows, TOKEN_DECIMALS)
+    segment = segments.Segment(filename)
+    expected = [[row[0], row[1], row[2], row[3], int(row[4]), row[5], row[6]] for row in rows]
+    assert segment.rows() == expected
+    assert segment.rows_at([1, 9, 8, 1500]) == [expected[1], expected[9], expected[8], expected[1500]]
+    assert [segment.real_price(i) for i in (0, 1999)] == [10 ** 24, 10 ** 24 + 1999]
+
+    assert segment.find_tx(f"0x{1500:064x}") == 1500
+    assert segment.find_tx("0xshort") == 7
+    assert segment.find_tx(TX.upper()) == 9
+    assert segment.find_tx(TX) is None
+    assert list(segment.postings("buyer", "0x" + "cd" * 20)) == [1, 5, 9]
+    assert list(segment.postings("buyer", "0xbuyer")) == [2, 6, 10]
+    segment.close()
+
+
+def test_hashes_and_addresses_are_stored_as_bytes(tmp_path, rows):
+    filename = str(tmp_path / "week.seg")
+    footer = segments.write_segment(filename, HEADER, rows, TOKEN_DECIMALS)
+    assert footer["widths"]["txHash"] == 32
+    assert footer["widths"]["buyers"] == 20
+    assert sorted(footer["odd"]["txHash"]) == ["7", "8", "9"]
+    assert footer["columns"]["txHash"][1] == 32 * len(rows)
+    assert "realPrice" not in footer["columns"]
@@ -0,0 +1,56 @@
+import pytest
+from fastapi import HTTPException
+
+import streaming
+
+ETAG = '"1a-2b-3c"'
+LAST_MODIFIED = "Wed, 14 Oct 2026 12:00:00 GMT"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    # A suffix longer than the file is the whole file, an end past it is cut.
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    (" bytes=5-5 ", (5, 5)),
+])
+def test_parse_range(header, expected):
+    assert streaming.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "bytes=-", "items=0-5", "bytes=0-5,10-20", "bytes=abc"])
+def test_parse_range_sends_everything(header):
+    assert streaming.parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=10-5", 1000), ("bytes=0-", 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(HTTPException) as raised:
+        streaming.parse_range(header, size)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("headers, expected", [
+    (None, False),
+    ({}, False),
+    ({"if-none-match": ETAG}, True),
+    ({"if-none-match": f'W/{ETAG}'}, True),
+    ({"if-none-match": f'"other", {ETAG}'}, True),
+    ({"if-none-match": "*"}, True),
+    ({"if-none-match": '"other"'}, False),
+    ({"if-modified-since": LAST_MODIFIED}, True),
+    ({"if-modified-since": "Thu, 15 Oct 2026 12:00:00 GMT"}, True),
+    ({"if-modified-since": "Tue, 13 Oct 2026 12:00:00 GMT"}, False),
+    ({"if-modified-since": "yesterday"}, False),
+    # If-None-Match wins over If-Modified-Since when both are sent.
+    ({"if-none-match": '"other"', "if-modified-since": LAST_MODIFIED}, False),
+])
+def test_not_modified(headers, expected):
+    assert streaming.not_modified(headers, ETAG, LAST_MODIFIED) is expected
+
+
+def test_not_modified_without_last_modified():
+    assert streaming.not_modified({"if-modified-since": LAST_MODIFIED}, ETAG) is False
@@ -0,0 +1,84 @@
+import csv
+import importlib
+
+import pytest
+
+from test_ingestion import WEEK, closed_week_timestamps, run, run_previous_week
+
+
+@pytest.fixture
+def unique(tracker_env, monkeypatch):
+    """lords_unique, reading what the tracker fixture writes."""
+    module = importlib.import_module("lords_unique")
+    monkeypatch.setattr(module, "DB", tracker_env.DB)
+    monkeypatch.setattr(module, "MANIFEST", type(module.MANIFEST)(tracker_env.MANIFEST.filename))
+    monkeypatch.setattr(module, "closed_weeks", None)
+    module.reset_aggregate_state(None, None)
+    return module
+
+
+def unique_rows(week_start):
+    with open(f"./lords_unique/lords_unique_{week_start}.csv", newline='') as f:
+        return {row["Address"]: row["WETH"] for row in csv.DictReader(f)}
+
+
+def test_late_sales_reach_the_closed_week_totals(tracker_env, market, unique, monkeypatch):
+    tracker = tracker_env
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [])
+    market.sales["lords"] = [market.sale(1, current - 500), market.sale(6, current - 501)]
+    with monkeypatch.context() as patch:
+        for module in (tracker, unique):
+            patch.setattr(module, "get_week_timestamps", lambda: (previous, current))
+        state["last_timestamp"] = run(tracker.poll_new_transactions(
+            "lords", state["store"], state["last_timestamp"], None, state["checkpoint"]
+        ))
+        assert unique.update_unique_buyers()
+    assert unique_rows(previous) == {f"0x{1:040x}": "2"}
+
+    # Sold in the ending week after its last regular poll, found by the final one.
+    market.sales["lords"] = [market.sale(9, current + 20), market.sale(11, current - 3)] + market.sales["lords"]
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert closed_week_timestamps(tracker, previous) == [current - 501, current - 500, current - 3]
+
+    # The running totals have moved on to the new week by the clock.
+    unique.update_unique_buyers()
+    assert unique_rows(previous) == {f"0x{1:040x}": "2"}
+    assert unique.finish_closed_weeks()
+    assert unique_rows(previous) == {f"0x{1:040x}": "3"}
+    assert unique.closed_weeks == {previous}
+    assert not unique.finish_closed_weeks()
+
+
+def test_a_week_closed_while_the_service_was_down_is_rebuilt(tracker_env, market, unique, monkeypatch):
+    tracker = tracker_env
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [])
+    market.sales["lords"] = [market.sale(2, current - 5), market.sale(7, current - 6), market.sale(3, current - 7)]
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+
+    assert unique.finish_closed_weeks()
+    assert unique_rows(previous) == {f"0x{2:040x}": "2", f"0x{3:040x}": "1"}
+    # Remembered across restarts.
+    unique.closed_weeks = None
+    assert not unique.finish_closed_weeks()
+
+
+class FakeRequest:
+    headers = {}
+
+
+def test_a_past_week_is_immutable_only_once_rebuilt(tracker_env, market, unique, monkeypatch):
+    tracker = tracker_env
+    current, _ = tracker.get_week_timestamps()
+    state, previous, current = run_previous_week(tracker, market, monkeypatch, [market.sale(1, current - 500)])
+    with monkeypatch.context() as patch:
+        patch.setattr(unique, "get_week_timestamps", lambda: (previous, current))
+        assert unique.update_unique_buyers()
+
+    # Past by the clock, but the week's last poll has not closed it yet.
+    response = run(unique.get_unique_with_timestamp(previous, FakeRequest()))
+    assert response.headers["Cache-Control"] != unique.streaming.IMMUTABLE
+
+    run(tracker.poll_collection("lords", state, None, tracker.new_fetch_stats()))
+    assert unique.finish_closed_weeks()
+    response = run(unique.get_unique_with_timestamp(previous, FakeRequest()))
+    assert response.headers["Cache-Control"] == unique.streaming.IMMUTABLE
@@ -2,29 +2,52 @@ import os
 from fastapi import FastAPI
 from datetime import datetime, timezone
 import re
+import manifest
 
 app = FastAPI()
 
+# The tracker keeps the manifest current; it is re-read only when it changes.
+MANIFEST = manifest.WeekManifest()
+_cached = {"mtime_ns": None, "timestamps": []}
+
+
+def week_entry(timestamp: int):
+    start_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    end_time = datetime.fromtimestamp(timestamp + 7 * 24 * 60 * 60, tz=timezone.utc)
+    return {
+        "timestamp": timestamp,
+        "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S UTC"),
+        "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S UTC")
+    }
+
+
+def get_timestamps_from_manifest():
+    MANIFEST.reload_if_changed()
+    if MANIFEST.mtime_ns is None:
+        return None
+    if _cached["mtime_ns"] != MANIFEST.mtime_ns:
+        timestamps = []
+        for timestamp, week in MANIFEST.weeks("lords").items():
+            entry = week_entry(timestamp)
+            entry["rows"] = week["rows"]
+            entry["volume"] = {token: str(units) for token, units in week["volume"].items()}
+            timestamps.append(entry)
+        _cached["timestamps"] = timestamps
+        _cached["mtime_ns"] = MANIFEST.mtime_ns
+    return _cached["timestamps"]
+
 
 def get_timestamps_from_files():
     timestamps = []
     directory = "./lords_buyers"
 
-    pattern = r'lords_buyers_(\d+)\.csv'
+    pattern = r'lords_buyers_(\d+)\.csv$'
 
     try:
         for filename in os.listdir(directory):
             match = re.match(pattern, filename)
             if match:
-                timestamp = int(match.group(1))
-                start_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                end_time = datetime.fromtimestamp(timestamp + 7 * 24 * 60 * 60, tz=timezone.utc)
-
-                timestamps.append({
-                    "timestamp": timestamp,
-                    "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S UTC"),
-                    "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S UTC")
-                })
+                timestamps.append(week_entry(int(match.group(1))))
 
         timestamps.sort(key=lambda x: x["timestamp"], reverse=True)
         return timestamps
@@ -36,7 +59,10 @@ def get_timestamps_from_files():
 
 @app.get("/timestamps")
 async def get_timestamps():
-    timestamps = get_timestamps_from_files()
+    timestamps = get_timestamps_from_manifest()
+    if timestamps is None:
+        # No manifest until the tracker has run once.
+        timestamps = get_timestamps_from_files()
     if timestamps:
         return {"timestamps": timestamps}
     return {"error": "No timestamps found"}
@@ -0,0 +1,1805 @@
+import asyncio
+import aiohttp
+import json
+import os
+import io
+import csv
+import random
+import functools
+import contextlib
+import re
+import mmap
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+import uvicorn
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from key_pool import ApiKeyPool
+from sales import Sale, batch_decoder, page_decoder
+from sale_store import SaleStore
+import sales_db
+import segments
+import manifest
+import log_index
+import sales_query
+import buyer_index
+import rollups
+import streaming
+
+load_dotenv()
+
+TOKEN_MAPPING = {
+    "0xc99a6a985ed2cac1ef41640596c5a5f9f4e19ef5": ("WETH", 1e18),
+    "0x97a9107c1793bc407d6f527b77e7fff4d812bece": ("AXS", 1e18),
+    "0x0b7007c13325c48911f73a2dad5fa5dcbf808adc": ("USDC", 1e6),
+    "0xe514d9deb7966c8be0ca922de8a064264ea6bcd4": ("WRON", 1e18)
+}
+
+TOKEN_DECIMALS = {symbol: len(str(int(scale))) - 1 for symbol, scale in TOKEN_MAPPING.values()}
+TOKEN_SCALES = {symbol: scale for symbol, scale in TOKEN_MAPPING.values()}
+
+# One entry per tracked collection. "dedup" names the transaction field a
+# purchase is keyed on: packs are ERC1155, so the same tx can settle several
+# orders and they are keyed on orderId + quantity instead of txHash. Each
+# "api_key_env" key joins the pool that every collection's requests draw from.
+# "fields" lists sale fields requested on top of SALE_FIELDS. "port" is the
+# one the collection's own process served on, which the tracker still listens on.
+COLLECTIONS = {
+    "lords": {
+        "token_address": "0xa1ce53b661be73bf9a5edd3f0087484f0e3e7363",
+        "api_key_env": "SM_API_KEY",
+        "id_column": "lords_id",
+        "dedup": "txHash",
+        "port": 8000
+    },
+    "packs": {
+        "token_address": "0x0328b534d094b097020b4538230f998027a54db0",
+        "api_key_env": "SM_API_KEY_2",
+        "id_column": "packs_id & quantity",
+        "dedup": "orderId",
+        "fields": ["quantity", "orderId"],
+        "port": 8002
+    },
+    "skins": {
+        "token_address": "0xa899849929e113315200609be208e6a0858f645c",
+        "api_key_env": "SM_API_KEY_3",
+        "id_column": "skins_id",
+        "dedup": "txHash",
+        "port": 8006
+    },
+    "units": {
+        "token_address": "0xa038c593115f6fcd673f6833e15462b475994879",
+        "api_key_env": "SM_API_KEY_4",
+        "id_column": "units_id",
+        "dedup": "txHash",
+        "port": 8004
+    }
+}
+
+# "csv" keeps each week in ./<collection>_buyers/ as an append log. "sqlite"
+# keeps every collection in one WAL-mode database that the unique services
+# read as well; the buyers CSVs are then rendered from it on request.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv")
+SALES_DB = os.getenv("SALES_DB", "./sales.db")
+DB = sales_db.connect(SALES_DB) if STORAGE_BACKEND == "sqlite" else None
+
+MANIFEST = manifest.WeekManifest()
+MANIFEST.load()
+
+# The database answers buyer lookups from its own index.
+BUYERS = buyer_index.BuyerIndex()
+if DB is None:
+    BUYERS.load()
+
+API_URL = "https://api-gateway.skymavis.com/graphql/mavis-marketplace"
+
+# Only what extract_records reads; asset metadata is opt-in because the
+# attribute blobs dominate the response size.
+SALE_FIELDS = ["maker", "matcher", "paymentToken", "realPrice", "timestamp", "txHash", "orderKind"]
+
+METADATA_FIELDS = """token {
+          ... on Erc721 {
+            numActiveOffers
+            name
+            cdnImage
+            attributes
+          }
+        }"""
+
+QUERY_METADATA = os.getenv("QUERY_METADATA", "0") == "1"
+
+PAGE_SIZE = 40
+
+# Backfill walks the week with large pages and several offsets in flight;
+# steady-state polls start small since they usually only find a few sales.
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "50"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+POLL_PAGE_SIZE = int(os.getenv("POLL_PAGE_SIZE", "10"))
+
+# Poll intervals shrink while sales are flowing and stretch when the market is
+# quiet or the API is failing, but a collection never spends more than
+# POLL_REQUESTS_PER_HOUR requests per hour on polling.
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "60"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "15"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+POLL_REQUESTS_PER_HOUR = float(os.getenv("POLL_REQUESTS_PER_HOUR", "240"))
+
+# Poll the first page of every collection in one aliased GraphQL request;
+# set to 0 to give each collection its own poll loop and schedule.
+BATCH_POLLING = os.getenv("BATCH_POLLING", "1") == "1"
+
+# Shared by every collection's fetches, so the whole engine keeps at most this
+# many connections open to the marketplace API.
+MAX_CONNECTIONS = 8
+
+# File reads and writes run on this pool so a large CSV never stalls the
+# pollers or the HTTP handlers sharing the event loop.
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+# Default per-key request budget; a single key can be overridden with
+# <ENV NAME>_RATE, e.g. SM_API_KEY_2_RATE=5.
+API_KEY_RATE = float(os.getenv("API_KEY_RATE", "2"))
+API_KEY_BURST = float(os.getenv("API_KEY_BURST", "5"))
+
+
+def build_key_pool():
+    keys = {}
+    for collection in COLLECTIONS.values():
+        env_name = collection["api_key_env"]
+        secret = os.getenv(env_name)
+        if secret:
+            keys[env_name] = (secret, float(os.getenv(f"{env_name}_RATE", "0")) or None)
+    if not keys:
+        print("Warning: no marketplace API keys found in the environment.")
+    return ApiKeyPool(keys, API_KEY_RATE, API_KEY_BURST)
+
+
+KEY_POOL = build_key_pool()
+
+
+def build_selection(name: str, include_metadata: bool = False):
+    fields = SALE_FIELDS + COLLECTIONS[name].get("fields", [])
+    asset_fields = "id\n        " + METADATA_FIELDS if include_metadata else "id"
+    lines = "".join(f"      {field}\n" for field in fields)
+    return f"""{{
+    results {{
+{lines}      assets {{
+        {asset_fields}
+      }}
+    }}
+  }}"""
+
+
+@functools.lru_cache(maxsize=None)
+def build_query(name: str, include_metadata: bool = False):
+    # The text only depends on the collection, so it is built once and every
+    # page request just sends different variables.
+    return f"""query SoldAssets($tokenAddress: String!, $size: Int!, $offset: Int!) {{
+  recentlySolds(size: $size, tokenAddress: $tokenAddress, from: $offset) {build_selection(name, include_metadata)}
+}}
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def build_batch_query(names: tuple, include_metadata: bool = False):
+    params = "".join(f"${name}: String!, " for name in names)
+    blocks = "".join(
+        f"  {name}: recentlySolds(size: $size, tokenAddress: ${name}, from: 0) {build_selection(name, include_metadata)}\n"
+        for name in names
+    )
+    return f"query BatchSold({params}$size: Int!) {{\n{blocks}}}\n"
+
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(IO_EXECUTOR, functools.partial(func, *args))
+
+
+_file_locks = {}
+
+
+def file_lock(filename: str):
+    # Writes to a file are serialised; files nobody is writing are read
+    # concurrently.
+    if filename not in _file_locks:
+        _file_locks[filename] = asyncio.Lock()
+    return _file_locks[filename]
+
+
+async def write_io(filename: str, func, *args):
+    async with file_lock(filename):
+        return await run_io(func, *args)
+
+
+INITIAL_WEEK_START = datetime(
+    2025, 2, 10,
+    13, 0, 0,
+    tzinfo=timezone.utc
+)
+
+
+def get_week_timestamps():
+    initial_start = INITIAL_WEEK_START
+
+    now = datetime.now(timezone.utc)
+
+    if now < initial_start:
+        start_time = initial_start
+    else:
+        delta = now - initial_start
+        intervals = int(delta.total_seconds() // (7 * 24 * 60 * 60))
+        start_time = initial_start + timedelta(days=7 * intervals)
+
+    end_time = start_time + timedelta(days=7)
+
+    return int(start_time.timestamp()), int(end_time.timestamp())
+
+
+def week_starts_between(start: int, end: int):
+    """Start timestamps of the tracked weeks overlapping [start, end)."""
+    first_week = int(INITIAL_WEEK_START.timestamp())
+    _, current_end = get_week_timestamps()
+    start, end = max(start, first_week), min(end, current_end)
+    if start >= end:
+        return []
+    week = first_week + (start - first_week) // rollups.WEEK * rollups.WEEK
+    return list(range(week, end, rollups.WEEK))
+
+
+def get_fieldnames(name: str):
+    # "price" is the display string; realPrice (integer base units) and token
+    # are what totals are computed from. Collections deduplicated on orderId
+    # keep it, so reloaded sales are keyed like fetched ones.
+    fieldnames = ['buyer', COLLECTIONS[name]["id_column"], 'price', 'txHash', 'timestamp', 'realPrice', 'token']
+    if COLLECTIONS[name]["dedup"] == "orderId":
+        fieldnames.append('orderId')
+    return fieldnames
+
+
+def get_current_filename(name: str, week_start: int = None):
+    """The week's log; the current week's unless week_start is given."""
+    if week_start is None:
+        week_start, _ = get_week_timestamps()
+    os.makedirs(f"./{name}_buyers", exist_ok=True)
+    return f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+
+
+def load_buyers(name: str):
+    if DB is not None:
+        return load_buyers_table(name)
+
+    store = SaleStore(TOKEN_DECIMALS)
+    filename = get_current_filename(name)
+    if os.path.exists(filename):
+        try:
+            with open(filename, 'r', newline='') as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    row['timestamp'] = int(row['timestamp'])
+                    purchase_id = record_purchase_id(name, row)
+                    if purchase_id:
+                        store_record(name, store, purchase_id, row)
+        except Exception as e:
+            print(f"[{name}] Error loading buyers file: {e}")
+    return store
+
+
+def load_buyers_table(name: str):
+    week_start, week_end = get_week_timestamps()
+    table = sales_db.SaleTable(DB, name, week_start, week_end, TOKEN_DECIMALS, format_units)
+
+    # A week started under the CSV backend is carried over the first time
+    # the database is used for it.
+    filename = get_current_filename(name)
+    if os.path.exists(filename) and not len(table):
+        purchase_ids = []
+        try:
+            with open(filename, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    row['timestamp'] = int(row['timestamp'])
+                    purchase_id = record_purchase_id(name, row)
+                    if purchase_id and store_record(name, table, purchase_id, row):
+                        purchase_ids.append(purchase_id)
+            table.write(purchase_ids)
+            DB.commit()
+            print(f"[{name}] Imported {len(table)} sale(s) from {filename}")
+        except Exception as e:
+            DB.rollback()
+            table.forget(purchase_ids)
+            print(f"[{name}] Error importing buyers file: {e}")
+    return table
+
+
+def append_buyers(name: str, new_records: list, week_start: int = None, store=None, purchase_ids: list = ()):
+    """Make a page of records durable; raises if it could not be.
+
+    Under the database the page is the store's queued sales of purchase_ids.
+    """
+    if not new_records:
+        return
+    if DB is not None:
+        # Inserted and committed with nothing awaited in between, so the
+        # transaction holds this page and nothing else.
+        try:
+            if store is not None:
+                store.write(purchase_ids)
+            DB.commit()
+        except Exception as e:
+            DB.rollback()
+            print(f"[{name}] Error committing sales:", e)
+            raise
+        return
+    filename = get_current_filename(name, week_start)
+    size = os.path.getsize(filename) if os.path.exists(filename) else 0
+    try:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=get_fieldnames(name))
+        if not size:
+            writer.writeheader()
+        writer.writerows(new_records)
+
+        with open(filename, "a", newline='') as f:
+            f.write(buffer.getvalue())
+    except Exception as e:
+        print(f"[{name}] Error appending to buyers file:", e)
+        # Cut off a partly written page, so the retry appends whole rows.
+        if os.path.exists(filename):
+            os.truncate(filename, size)
+        raise
+
+
+# These run on IO_EXECUTOR threads. Rows are read and written one call at a
+# time rather than through list(reader)/writerows, which hold the GIL for the
+# whole file and would stall the event loop just the same.
+def read_sorted_rows(filename: str):
+    rows = []
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        for row in reader:
+            rows.append(row)
+    if header is None:
+        return None, [], True
+
+    ts_index = header.index("timestamp")
+    keys = [int(row[ts_index]) for row in rows]
+    if all(keys[i] >= keys[i + 1] for i in range(len(keys) - 1)):
+        return header, rows, True
+    order = sorted(range(len(rows)), key=keys.__getitem__, reverse=True)
+    return header, [rows[i] for i in order], False
+
+
+def compact_buyers(filename: str):
+    """Rewrite a closed week's append log newest first and segment it, once."""
+    try:
+        segment_filename = segments.segment_filename(filename)
+        if not os.path.exists(filename) or os.path.exists(segment_filename):
+            return
+        header, rows, already_sorted = read_sorted_rows(filename)
+        if header is None:
+            return
+
+        if not already_sorted:
+            tmp_filename = f"{filename}.tmp"
+            with open(tmp_filename, "w", newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for row in rows:
+                    writer.writerow(row)
+            os.replace(tmp_filename, filename)
+        segments.write_segment(segment_filename, header, rows, TOKEN_DECIMALS)
+        streaming.precompress(filename)
+    except Exception as e:
+        print(f"Error compacting buyers file {filename}: {e}")
+
+
+def index_week(name: str, week_start: int):
+    """Put a week's row count and volume in the manifest.
+
+    Closed weeks are read from their segment footer, the live one is counted
+    from its log or the database.
+    """
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    segment_filename = segments.segment_filename(filename)
+    if os.path.exists(segment_filename):
+        footer = open_segment(segment_filename).footer
+        volume = {token: int(totals["units"]) for token, totals in footer["tokens"].items()}
+        MANIFEST.set_week(name, week_start, footer["rows"], volume, closed=True)
+        return
+
+    if DB is not None:
+        header, rows = get_fieldnames(name), db_week_csv_rows(name, week_start)
+    elif os.path.exists(filename):
+        with open(filename, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None) or get_fieldnames(name)
+            rows = [row for row in reader]
+    else:
+        return
+
+    columns = {column: i for i, column in enumerate(header)}
+    volume = {}
+    for row in rows:
+        if "realPrice" in columns and row[columns["realPrice"]]:
+            units, token = int(row[columns["realPrice"]]), row[columns["token"]]
+        else:
+            amount, token = row[columns["price"]].split()
+            units = int(Decimal(amount).scaleb(TOKEN_DECIMALS[token]))
+        volume[token] = volume.get(token, 0) + units
+    MANIFEST.set_week(name, week_start, len(rows), volume)
+
+
+def index_buyers_week(name: str, week_start: int):
+    """Add a week to the buyer index: from its segment once closed, else its log."""
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    segment_filename = segments.segment_filename(filename)
+    if os.path.exists(segment_filename):
+        return BUYERS.add_segment(name, week_start, open_segment(segment_filename))
+    source = open_week_index(name, week_start)
+    if source is not None:
+        BUYERS.add_log_rows(name, week_start, source)
+    return False
+
+
+# Rollups of past weeks, most recently used last; they never change, so a
+# dropped one is just rebuilt.
+_closed_rollups = OrderedDict()
+ROLLUP_CACHE_WEEKS = int(os.getenv("ROLLUP_CACHE_WEEKS", "64"))
+_rollups_lock = threading.Lock()
+# The live week's rollup per collection, fed as pages are persisted.
+_live_rollups = {}
+
+
+def scan_week(name: str, week_start: int, since: int, until: int):
+    """(timestamp, buyer, token, units) of the sales with since <= timestamp < until, within one week."""
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    if DB is not None and not os.path.exists(segments.segment_filename(filename)):
+        return [(row[5], row[0], row[7], int(row[6])) for row in sales_db.week_rows(DB, name, since, until)]
+    source = open_week_index(name, week_start)
+    if source is None:
+        return []
+    if isinstance(source, segments.Segment):
+        start, stop = source.between(since, until)
+        timestamps, symbols = source.timestamps(), source.footer["token_symbols"]
+        buyer_codes, token_codes = source.buyer_codes(), source.token_codes()
+        return [
+            (timestamps[i], source.buyer(buyer_codes[i]), symbols[token_codes[i]], source.real_price(i))
+            for i in range(start, stop)
+        ]
+    return [
+        (source.timestamps[row], source.buyers[row], source.tokens[row], source.real_prices[row])
+        for row in source.newest_first(since, until)
+    ]
+
+
+def week_rollup(name: str, week_start: int):
+    live = _live_rollups.get(name)
+    if live is not None and live.week_start == week_start:
+        return live
+    current_ts, _ = get_week_timestamps()
+    if week_start >= current_ts:
+        # A new week that start_week has not set up yet.
+        return None
+    with _rollups_lock:
+        rollup = _closed_rollups.get((name, week_start))
+        if rollup is not None:
+            _closed_rollups.move_to_end((name, week_start))
+            return rollup
+    # Past weeks no longer change, so each is rolled up once: from its
+    # segment, or from the rows of one that was never segmented.
+    segment_filename = f"./{name}_buyers/{name}_buyers_{week_start}.seg"
+    if os.path.exists(segment_filename):
+        rollup = rollups.segment_rollup(week_start, open_segment(segment_filename))
+    else:
+        rollup = rollups.WeekRollup(week_start)
+        for timestamp, buyer, token, units in scan_week(name, week_start, week_start, week_start + rollups.WEEK):
+            rollup.add(timestamp, buyer, token, units)
+    with _rollups_lock:
+        _closed_rollups[(name, week_start)] = rollup
+        while len(_closed_rollups) > ROLLUP_CACHE_WEEKS:
+            _closed_rollups.popitem(last=False)
+    return rollup
+
+
+def segment_rollups(name: str, week_starts: list):
+    """{week_start: WeekRollup} for those weeks that are closed into segments."""
+    current_ts, _ = get_week_timestamps()
+    return {
+        week_start: week_rollup(name, week_start)
+        for week_start in week_starts
+        if week_start < current_ts and os.path.exists(f"./{name}_buyers/{name}_buyers_{week_start}.seg")
+    }
+
+
+def start_rollup(name: str, week_start: int):
+    """Roll up what the live week already holds; persist_records adds the rest."""
+    rollup = rollups.WeekRollup(week_start)
+    for timestamp, buyer, token, units in scan_week(name, week_start, week_start, week_start + rollups.WEEK):
+        rollup.add(timestamp, buyer, token, units)
+    _live_rollups[name] = rollup
+
+
+def _close_week(name: str, week_start: int, rows: list = None):
+    """Segment a week that has ended, once, and mark it closed.
+
+    Runs on IO_EXECUTOR. Under the database rows are the week's rows, read
+    by close_week on the event loop thread.
+    """
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    if DB is None:
+        compact_buyers(filename)
+        drop_sorted_view(filename)
+        if os.path.exists(segments.segment_filename(filename)):
+            index_week(name, week_start)
+            MANIFEST.save()
+            if index_buyers_week(name, week_start):
+                BUYERS.save()
+        return
+
+    segment_filename = segments.segment_filename(filename)
+    if os.path.exists(segment_filename):
+        return
+    try:
+        if rows:
+            os.makedirs(f"./{name}_buyers", exist_ok=True)
+            segments.write_segment(segment_filename, get_fieldnames(name), rows, TOKEN_DECIMALS)
+            index_week(name, week_start)
+        elif MANIFEST.has_week(name, week_start):
+            # A week tracked without sales has nothing to segment, but the
+            # unique services wait for it to be marked closed.
+            MANIFEST.set_week(name, week_start, 0, {}, closed=True)
+        MANIFEST.save()
+    except Exception as e:
+        print(f"[{name}] Error writing segment {segment_filename}: {e}")
+
+
+async def close_week(name: str, week_start: int):
+    # The SQLite connection stays on the event loop thread, so the week's
+    # rows are read here; writing the segment goes to the pool either way.
+    rows = None
+    if DB is not None and not os.path.exists(f"./{name}_buyers/{name}_buyers_{week_start}.seg"):
+        rows = db_week_csv_rows(name, week_start)
+    await run_io(_close_week, name, week_start, rows)
+
+
+def upgrade_db_segments(name: str):
+    """Drop the database's segments in an older format; returns the weeks to close again.
+
+    Weeks whose log predates the database are rewritten from it here, on
+    IO_EXECUTOR; the others need their rows read on the event loop thread.
+    """
+    pattern = re.compile(rf"{name}_buyers_(\d+)\.seg")
+    from_rows = []
+    for filename in os.listdir(f"./{name}_buyers"):
+        match = pattern.fullmatch(filename)
+        if match and upgrade_segment(name, int(match.group(1))):
+            past_week = int(match.group(1))
+            csv_filename = f"./{name}_buyers/{name}_buyers_{past_week}.csv"
+            if not os.path.exists(csv_filename):
+                from_rows.append(past_week)
+                continue
+            compact_buyers(csv_filename)
+            if os.path.exists(segments.segment_filename(csv_filename)):
+                index_week(name, past_week)
+    return from_rows
+
+
+async def close_past_db_weeks(name: str, week_start: int):
+    for past_week in await run_io(upgrade_db_segments, name):
+        await close_week(name, past_week)
+    await close_week(name, week_start - 7 * 24 * 60 * 60)
+
+
+def close_past_weeks(name: str, week_start: int):
+    # Weeks closed before segments existed are converted on the first start,
+    # as are segments in an older format, and weeks missing from the manifest
+    # are indexed. Weeks the manifest has as closed are left alone, so a
+    # start does not map every segment.
+    pattern = re.compile(rf"{name}_buyers_(\d+)\.csv")
+    view_pattern = re.compile(rf"\.{name}_buyers_(\d+)\.sorted\.csv")
+    for filename in os.listdir(f"./{name}_buyers"):
+        view_match = view_pattern.fullmatch(filename)
+        if view_match and int(view_match.group(1)) < week_start:
+            # Left by a version that kept the copies of closed weeks.
+            drop_sorted_view(f"./{name}_buyers/{name}_buyers_{view_match.group(1)}.csv")
+        match = pattern.fullmatch(filename)
+        if match and int(match.group(1)) < week_start:
+            past_week = int(match.group(1))
+            upgraded = upgrade_segment(name, past_week)
+            segment_filename = segments.segment_filename(f"./{name}_buyers/{filename}")
+            if not upgraded and MANIFEST.is_closed(name, past_week) and os.path.exists(segment_filename):
+                continue
+            _close_week(name, past_week)
+            if not MANIFEST.has_week(name, past_week):
+                index_week(name, past_week)
+
+
+# Mapped segments, most recently used last. Segments never change once
+# written, so a mapping stays valid until it is evicted; one still in use by
+# a download is unmapped when that lets go of it.
+_segments = OrderedDict()
+SEGMENT_CACHE_SIZE = int(os.getenv("SEGMENT_CACHE_SIZE", "64"))
+_segments_lock = threading.Lock()
+
+
+def open_segment(filename: str):
+    with _segments_lock:
+        segment = _segments.get(filename)
+        if segment is not None:
+            _segments.move_to_end(filename)
+            return segment
+    segment = segments.Segment(filename)
+    with _segments_lock:
+        segment = _segments.setdefault(filename, segment)
+        while len(_segments) > SEGMENT_CACHE_SIZE:
+            _segments.popitem(last=False)
+    return segment
+
+
+def upgrade_segment(name: str, week_start: int):
+    """Drop a segment written in an older format, so close_week writes it again."""
+    segment_filename = f"./{name}_buyers/{name}_buyers_{week_start}.seg"
+    if not os.path.exists(segment_filename) or segments.is_current(segment_filename):
+        return False
+    with _segments_lock:
+        _segments.pop(segment_filename, None)
+    os.remove(segment_filename)
+    # Its row numbers may change, and the buyer index only forgets whole collections.
+    BUYERS.drop_collection(name)
+    print(f"[{name}] Rewriting segment {segment_filename} in the current format")
+    return True
+
+
+def upgrade_buyers_file(name: str, filename: str):
+    """Add the columns a log written by an older version is missing.
+
+    realPrice/token are parsed back from the display price; an orderId that
+    was never kept is left empty.
+    """
+    try:
+        with open(filename, 'r', newline='') as f:
+            reader = csv.DictReader(f)
+            if (reader.fieldnames or []) == get_fieldnames(name):
+                return
+            rows = list(reader)
+
+        for row in rows:
+            if not row.get("realPrice"):
+                amount, token = row["price"].split()
+                row["realPrice"] = int(Decimal(amount).scaleb(TOKEN_DECIMALS[token]))
+                row["token"] = token
+
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "w", newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=get_fieldnames(name))
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_filename, filename)
+        print(f"[{name}] Upgraded {filename} to columns {', '.join(get_fieldnames(name))}")
+    except Exception as e:
+        print(f"[{name}] Error upgrading buyers file {filename}: {e}")
+
+
+_sorted_views = {}
+
+
+def sorted_view_filename(filename: str):
+    return os.path.join(os.path.dirname(filename), f".{os.path.basename(filename)[:-len('.csv')]}.sorted.csv")
+
+
+def drop_sorted_view(filename: str):
+    # Once a week closes its downloads come from the log or segment, so its
+    # newest-first copy is removed; one being streamed stays readable.
+    view_filename = sorted_view_filename(filename)
+    cached = _sorted_views.get(os.path.dirname(filename))
+    if cached and cached[1] == view_filename:
+        _sorted_views.pop(os.path.dirname(filename), None)
+    try:
+        os.remove(view_filename)
+    except FileNotFoundError:
+        pass
+
+
+def snapshot_sorted_view(filename: str):
+    """What the live log's newest-first copy needs, taken under the log's lock.
+
+    The live week is an append log, so downloads get a newest-first copy
+    that is only rebuilt when the log has grown since the last request.
+    Refreshing the log's index is the only part that has to wait for an
+    append: rows never move once written, and the file opened here keeps
+    the bytes of a log that is rewritten meanwhile, so the copy itself is
+    written after the lock is released. Returns (view filename, None) when
+    the copy is up to date.
+    """
+    stat = os.stat(filename)
+    version = (filename, stat.st_size, stat.st_mtime_ns)
+    directory = os.path.dirname(filename)
+    view_filename = sorted_view_filename(filename)
+    cached = _sorted_views.get(directory)
+    if cached and cached[0] == version and os.path.exists(view_filename):
+        return view_filename, None
+
+    index = get_log_index(filename).snapshot()
+    return view_filename, (version, open(filename, 'rb'), index)
+
+
+def write_sorted_view(view_filename: str, snapshot) -> str:
+    # The copy is a hidden file next to the log, so it streams from disk like
+    # any other week, and os.replace leaves downloads of the old copy intact.
+    # Rows are copied as the bytes they were logged as, in the index's order.
+    version, log, index = snapshot
+    rows = list(index.newest_first())
+    offsets, lengths = index.offsets, index.lengths
+    header_end = offsets[0] if rows else index.size
+    tmp_filename = f"{view_filename}.{threading.get_ident()}.tmp"
+    with log, open(tmp_filename, "wb") as f:
+        if header_end:
+            with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                f.write(data[:header_end])
+                for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+                    f.write(b"".join(
+                        data[offsets[row]:offsets[row] + lengths[row]]
+                        for row in rows[start:start + STREAM_CHUNK_ROWS]
+                    ))
+    os.replace(tmp_filename, view_filename)
+
+    _sorted_views[os.path.dirname(view_filename)] = (version, view_filename)
+    return view_filename
+
+
+def get_checkpoint_filename(name: str):
+    return f"./{name}_buyers/{name}_checkpoint.json"
+
+
+def new_checkpoint(week_start: int):
+    return {
+        "week_start": week_start,
+        "last_timestamp": None,
+        "last_txhash": None,
+        "backfill_offset": 0,
+        "backfill_complete": False
+    }
+
+
+def load_checkpoint(name: str, week_start: int):
+    filename = get_checkpoint_filename(name)
+    if os.path.exists(filename):
+        try:
+            with open(filename, 'r') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("week_start") == week_start:
+                return checkpoint
+        except Exception as e:
+            print(f"[{name}] Error loading checkpoint: {e}")
+    return new_checkpoint(week_start)
+
+
+def save_checkpoint(name: str, checkpoint: dict):
+    try:
+        filename = get_checkpoint_filename(name)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_filename, filename)
+    except Exception as e:
+        print(f"[{name}] Error saving checkpoint: {e}")
+
+
+def advance_watermark(checkpoint: dict, records: list):
+    if not records:
+        return
+    newest = max(records, key=lambda r: r["timestamp"])
+    if checkpoint["last_timestamp"] is None or newest["timestamp"] > checkpoint["last_timestamp"]:
+        checkpoint["last_timestamp"] = newest["timestamp"]
+        checkpoint["last_txhash"] = newest["txHash"]
+
+
+def new_fetch_stats():
+    return {"requests": 0, "pages": 0, "bytes": 0, "errors": 0, "throttled": 0, "new_records": 0}
+
+
+def next_poll_interval(name: str, schedule: dict, stats: dict):
+    if stats["errors"]:
+        schedule["failures"] += 1
+        backoff = min(POLL_MAX_INTERVAL, schedule["interval"] * 2 ** schedule["failures"])
+        delay = random.uniform(backoff / 2, backoff)
+        print(f"[{name}] Poll failed ({stats['throttled']} throttled), backing off {delay:.0f}s.")
+        return delay
+
+    schedule["failures"] = 0
+    if stats["new_records"]:
+        schedule["interval"] = max(POLL_MIN_INTERVAL, schedule["interval"] / 2)
+    else:
+        schedule["interval"] = min(POLL_MAX_INTERVAL, schedule["interval"] * 1.25)
+
+    budget_floor = stats["requests"] * 3600 / POLL_REQUESTS_PER_HOUR
+    return max(schedule["interval"], budget_floor)
+
+
+def format_units(units: int, token_symbol: str):
+    return format_price(units / TOKEN_SCALES[token_symbol], token_symbol)
+
+
+def format_price(amount, token_symbol):
+    if amount.is_integer():
+        price_str = str(int(amount))
+    else:
+        price_str = f"{amount:.10f}".rstrip('0').rstrip('.')
+
+    return f"{price_str} {token_symbol}"
+
+
+def record_purchase_id(name: str, record: dict):
+    collection = COLLECTIONS[name]
+    asset_cell = record.get(collection["id_column"])
+    if not asset_cell or "txHash" not in record:
+        return None
+
+    if collection["dedup"] == "orderId":
+        # Rows logged before orderId was kept can only be keyed on the txHash
+        # they were settled in.
+        asset_id, quantity = asset_cell.split()
+        return f"{record.get('orderId') or record['txHash']}_{asset_id}_{quantity.rstrip('x')}"
+    return f"{record['txHash']}_{asset_cell.split()[0]}"
+
+
+def legacy_purchase_id(name: str, record: dict):
+    """The txHash key a sale had in a log from before orderId was kept, if it differs."""
+    if COLLECTIONS[name]["dedup"] != "orderId" or not record.get("orderId"):
+        return None
+    return record_purchase_id(name, {**record, "orderId": None})
+
+
+def store_record(name: str, store: SaleStore, purchase_id: str, record: dict):
+    """Add a record to the week's store; False if it was already there."""
+    if purchase_id in store:
+        return False
+    legacy_id = legacy_purchase_id(name, record)
+    if legacy_id is not None and legacy_id in store:
+        return False
+    asset_id, _, quantity = str(record[COLLECTIONS[name]["id_column"]]).partition(" ")
+    if record.get("realPrice"):
+        price, token = int(record["realPrice"]), record["token"]
+    else:
+        price, token = store.parse_price(record["price"])
+    return store.add(
+        purchase_id, record["buyer"], asset_id, record["txHash"], record["timestamp"],
+        price, token, int(quantity.rstrip("x") or 1)
+    )
+
+
+def extract_records(name: str, tx: Sale):
+    """Yield (purchase_id, record) for every asset sold in a transaction."""
+    collection = COLLECTIONS[name]
+    dedup_value = getattr(tx, collection["dedup"])
+    if not dedup_value:
+        return
+
+    ts = tx.timestamp
+    tokenSymbol = TOKEN_MAPPING.get(tx.paymentToken)
+    real_price = int(tx.realPrice)
+    amount = real_price / tokenSymbol[1]
+
+    order_kind = tx.orderKind
+    if order_kind == 2 or order_kind == 0:
+        buyer = tx.maker
+    else:
+        buyer = tx.matcher
+
+    for asset in tx.assets:
+        asset_id = asset.id
+        if not asset_id:
+            continue
+
+        if collection["dedup"] == "orderId":
+            quantity = int(tx.quantity)
+            purchase_id = f"{dedup_value}_{asset_id}_{quantity}"
+            asset_cell = f"{asset_id} {quantity}x"
+        else:
+            purchase_id = f"{dedup_value}_{asset_id}"
+            asset_cell = asset_id
+
+        yield purchase_id, {
+            "buyer": buyer,
+            collection["id_column"]: asset_cell,
+            "price": format_price(amount, tokenSymbol[0]),
+            "txHash": tx.txHash,
+            "timestamp": ts,
+            "realPrice": real_price,
+            "token": tokenSymbol[0],
+            **({"orderId": str(dedup_value)} if collection["dedup"] == "orderId" else {})
+        }
+
+
+async def post_query(label: str, payload: dict, session: aiohttp.ClientSession, decoder, stats: dict = None):
+    if stats is not None:
+        stats["requests"] += 1
+    key_label = None
+    status = None
+    try:
+        key_label, secret = await KEY_POOL.acquire()
+        headers = {
+            "Content-Type": "application/json",
+            "X-API-Key": secret
+        }
+        async with session.post(API_URL, headers=headers, json=payload) as response:
+            status = response.status
+            if response.status == 200:
+                body = await response.read()
+                if stats is not None:
+                    stats["pages"] += 1
+                    stats["bytes"] += len(body)
+                return decoder.decode(body)
+            else:
+                text = await response.text()
+                print(f"[{label}] Error fetching data:", response.status, text)
+                if stats is not None:
+                    stats["errors"] += 1
+                    if response.status == 429:
+                        stats["throttled"] += 1
+    except Exception as e:
+        print(f"[{label}] Exception during fetch:", e)
+        if stats is not None:
+            stats["errors"] += 1
+    finally:
+        if key_label is not None:
+            KEY_POOL.release(key_label, status)
+    return None
+
+
+async def fetch_transactions(name: str, offset: int, session: aiohttp.ClientSession, stats: dict = None, size: int = PAGE_SIZE):
+    payload = {
+        "query": build_query(name, QUERY_METADATA),
+        "variables": {
+            "tokenAddress": COLLECTIONS[name]["token_address"],
+            "size": size,
+            "offset": offset
+        }
+    }
+    response = await post_query(name, payload, session, page_decoder, stats)
+    # A 200 without results (a GraphQL error, throttling reported in the
+    # body) is a failed request; only an empty results list ends the history.
+    if response is None:
+        return None
+    if response.data is None or response.data.recentlySolds is None or response.data.recentlySolds.results is None:
+        print(f"[{name}] Response at offset {offset} has no results")
+        if stats is not None:
+            stats["errors"] += 1
+        return None
+    return response.data.recentlySolds.results
+
+
+async def fetch_first_pages(names: list, session: aiohttp.ClientSession, stats: dict = None, size: int = PAGE_SIZE):
+    """Fetch the newest page of several collections in one round trip.
+
+    Collections whose aliased block is missing from a partial response map to
+    None so their poll falls back to a request of its own.
+    """
+    variables = {name: COLLECTIONS[name]["token_address"] for name in names}
+    variables["size"] = size
+    payload = {
+        "query": build_batch_query(tuple(names), QUERY_METADATA),
+        "variables": variables
+    }
+    response = await post_query("batch", payload, session, batch_decoder, stats)
+    blocks = (response.data if response is not None else None) or {}
+
+    pages = {}
+    for name in names:
+        block = blocks.get(name)
+        pages[name] = block.results if block is not None else None
+    return pages
+
+
+async def persist_records(name: str, records: list, checkpoint: dict = None, store: SaleStore = None, purchase_ids: list = (), week_start: int = None):
+    """Append new records to the week's log, then save the checkpoint.
+
+    The week is the current one unless week_start is given. If the append
+    fails the error is raised before anything else moves, and the records
+    are forgotten by the store so the next poll fetches them again.
+    """
+    if records:
+        if week_start is None:
+            week_start, _ = get_week_timestamps()
+        filename = get_current_filename(name, week_start)
+        try:
+            if DB is not None:
+                append_buyers(name, records, week_start, store, purchase_ids)
+            else:
+                await write_io(filename, append_buyers, name, records, week_start)
+        except Exception:
+            if store is not None:
+                store.forget(purchase_ids)
+            raise
+        MANIFEST.add_records(name, week_start, records)
+        if DB is None:
+            await write_io(filename, index_buyers_week, name, week_start)
+        rollup = _live_rollups.get(name)
+        if rollup is not None and rollup.week_start == week_start:
+            for record in records:
+                rollup.add(int(record["timestamp"]), record["buyer"], record["token"], int(record["realPrice"]))
+        await write_io(MANIFEST.filename, MANIFEST.save)
+    if checkpoint is not None:
+        # A copy, since the loop keeps advancing the checkpoint meanwhile.
+        await write_io(get_checkpoint_filename(name), save_checkpoint, name, dict(checkpoint))
+
+
+async def historical_backfill(name: str, store: SaleStore, session: aiohttp.ClientSession, checkpoint: dict):
+    # New sales only push older ones to higher offsets, so resuming from the
+    # checkpointed frontier can re-read a few pages but never skips one.
+    next_offset = checkpoint["backfill_offset"]
+    print(f"[{name}] Starting historical backfill (offset {next_offset})...")
+    start_ts, end_ts = get_week_timestamps()
+    stats = new_fetch_stats()
+    started = asyncio.get_running_loop().time()
+    in_flight = {}
+    done = False
+
+    try:
+        while not done:
+            # Keep up to BACKFILL_CONCURRENCY offset windows in flight, paced by
+            # the shared key pool, then consume pages strictly in offset order.
+            while len(in_flight) < BACKFILL_CONCURRENCY:
+                in_flight[next_offset] = asyncio.create_task(
+                    fetch_transactions(name, next_offset, session, stats, BACKFILL_PAGE_SIZE)
+                )
+                next_offset += BACKFILL_PAGE_SIZE
+
+            offset = min(in_flight)
+            print(f"[{name}] Fetching transactions (offset {offset})...")
+            transactions = await in_flight.pop(offset)
+            if transactions is None:
+                print(f"[{name}] Backfill interrupted at offset {offset}, will resume from checkpoint.")
+                return
+            if not transactions:
+                print(f"[{name}] No more transactions found.")
+                break
+
+            page_records, page_ids = [], []
+            for tx in transactions:
+                ts = tx.timestamp
+
+                if ts < start_ts:
+                    print(f"[{name}] Encountered a transaction older than the start timestamp. Backfill complete.")
+                    done = True
+                    break
+
+                if ts >= end_ts:
+                    continue
+
+                for purchase_id, record in extract_records(name, tx):
+                    if not store_record(name, store, purchase_id, record):
+                        continue
+
+                    print(f"[{name}] Recording historical record: {record}")
+                    page_records.append(record)
+                    page_ids.append(purchase_id)
+
+            # The checkpoint only moves on once the page is durable.
+            saved = dict(checkpoint)
+            advance_watermark(saved, page_records)
+            saved["backfill_offset"] = offset + BACKFILL_PAGE_SIZE
+            await persist_records(name, page_records, saved, store, page_ids)
+            checkpoint.update(saved)
+
+            if len(transactions) < BACKFILL_PAGE_SIZE:
+                break
+    finally:
+        for task in in_flight.values():
+            task.cancel()
+
+    checkpoint["backfill_complete"] = True
+    await persist_records(name, [], checkpoint)
+
+    elapsed = asyncio.get_running_loop().time() - started
+    rate = stats["pages"] / elapsed if elapsed > 0 else 0.0
+    print(f"[{name}] Caught up in {elapsed:.1f}s: {stats['pages']} page(s), "
+          f"{stats['bytes']} bytes, {rate:.2f} pages/s.")
+
+
+async def poll_new_transactions(name: str, store: SaleStore, last_timestamp: int, session: aiohttp.ClientSession, checkpoint: dict = None, stats: dict = None, first_page: list = None, week: tuple = None):
+    """Persist the sales newer than last_timestamp and return the new watermark.
+
+    week is the (start, end) whose sales are kept, the current one by default.
+    """
+    print(f"[{name}] Polling for new transactions...")
+    offset = 0
+    new_last_timestamp = last_timestamp
+    new_records, new_ids = [], []
+    if stats is None:
+        stats = new_fetch_stats()
+    start_ts, end_ts = week or get_week_timestamps()
+    reached_watermark = False
+    size = POLL_PAGE_SIZE
+
+    while not reached_watermark:
+        if offset == 0 and first_page is not None:
+            transactions = first_page
+        else:
+            transactions = await fetch_transactions(name, offset, session, stats, size)
+        if not transactions:
+            break
+
+        # Results are newest first, so once we hit a sale below the
+        # watermark everything after it has already been persisted. Sales in
+        # the watermark's own second may have arrived since; store_record
+        # skips the ones already stored.
+        for tx in transactions:
+            ts = tx.timestamp
+
+            if ts < last_timestamp or ts < start_ts:
+                reached_watermark = True
+                break
+
+            if ts >= end_ts:
+                continue
+
+            for purchase_id, record in extract_records(name, tx):
+                if not store_record(name, store, purchase_id, record):
+                    continue
+
+                print(f"[{name}] Found new record: {record}")
+                new_records.append(record)
+                new_ids.append(purchase_id)
+                new_last_timestamp = max(new_last_timestamp, ts)
+
+        if len(transactions) < size:
+            break
+        # A full page of new sales means we are behind, so widen the window.
+        offset += size
+        size = min(size * 2, BACKFILL_PAGE_SIZE)
+
+    print(f"[{name}] Poll used {stats['pages']} page(s), {stats['bytes']} bytes.")
+    stats["new_records"] += len(new_records)
+
+    if new_records:
+        # Neither the checkpoint nor the returned watermark move unless the
+        # page is durable; a failed append raises out of the poll.
+        saved = dict(checkpoint) if checkpoint is not None else None
+        if saved is not None:
+            advance_watermark(saved, new_records)
+        await persist_records(name, new_records, saved, store, new_ids, start_ts)
+        if checkpoint is not None:
+            checkpoint.update(saved)
+    else:
+        print(f"[{name}] No new transactions found.")
+
+    return new_last_timestamp
+
+
+def week_state(name: str, week_start: int, week_end: int, store):
+    checkpoint = load_checkpoint(name, week_start)
+    if checkpoint["backfill_complete"]:
+        print(f"[{name}] Week already backfilled, resuming from {checkpoint['last_timestamp']} ({checkpoint['last_txhash']}).")
+
+    # The first poll after startup fetches only the gap since the newest
+    # persisted sale and stops as soon as it reaches it.
+    return {
+        "week_start": week_start,
+        "week_end": week_end,
+        "filename": get_current_filename(name, week_start),
+        "store": store,
+        "checkpoint": checkpoint,
+        "last_timestamp": store.max_timestamp(week_start)
+    }
+
+
+def _start_week(name: str):
+    # The CSV backend's start_week, run on IO_EXECUTOR.
+    week_start, week_end = get_week_timestamps()
+    filename = get_current_filename(name)
+    if not os.path.exists(filename):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=get_fieldnames(name))
+            writer.writeheader()
+        print(f"[{name}] Created new weekly file: {filename}")
+    else:
+        upgrade_buyers_file(name, filename)
+
+    store = load_buyers(name)
+
+    close_past_weeks(name, week_start)
+    # The live week is recounted on every start, in case the last run
+    # stopped between appending a page and saving the manifest.
+    index_week(name, week_start)
+    MANIFEST.save()
+
+    # Closed weeks enter the buyer index once; the live week is reread.
+    added = False
+    for past_week in MANIFEST.weeks(name):
+        if past_week < week_start and not BUYERS.has_closed_week(name, past_week):
+            added = index_buyers_week(name, past_week) or added
+    index_buyers_week(name, week_start)
+    if added:
+        BUYERS.save()
+
+    start_rollup(name, week_start)
+    return week_state(name, week_start, week_end, store)
+
+
+async def start_week(name: str):
+    if DB is None:
+        return await run_io(_start_week, name)
+
+    # Under the database what is read from it stays on the event loop
+    # thread, and the segments of past weeks are written on the pool.
+    week_start, week_end = get_week_timestamps()
+    store = load_buyers(name)
+    await close_past_db_weeks(name, week_start)
+    index_week(name, week_start)
+    await run_io(MANIFEST.save)
+    start_rollup(name, week_start)
+    return week_state(name, week_start, week_end, store)
+
+
+async def poll_collection(name: str, state: dict, session: aiohttp.ClientSession, stats: dict, first_page: list = None):
+    current_time = datetime.now(timezone.utc).timestamp()
+    if current_time > state["week_end"]:
+        # One last poll of the ending week picks up the sales made since the
+        # previous one; if it fails the week stays open and is retried.
+        errors = stats["errors"]
+        state["last_timestamp"] = await poll_new_transactions(
+            name, state["store"], state["last_timestamp"], session,
+            state["checkpoint"], stats, week=(state["week_start"], state["week_end"])
+        )
+        if stats["errors"] > errors:
+            print(f"[{name}] Final poll of the week failed, will retry before closing it.")
+            return
+        print(f"[{name}] End timestamp reached, starting new week...")
+        await close_week(name, state["week_start"])
+        state.update(await start_week(name))
+
+    checkpoint = state["checkpoint"]
+    if not checkpoint["backfill_complete"]:
+        await historical_backfill(name, state["store"], session, checkpoint)
+        if checkpoint["last_timestamp"] is not None:
+            state["last_timestamp"] = max(state["last_timestamp"], checkpoint["last_timestamp"])
+
+    state["last_timestamp"] = await poll_new_transactions(
+        name, state["store"], state["last_timestamp"],
+        session, checkpoint, stats, first_page
+    )
+
+
+async def collection_task(name: str, session: aiohttp.ClientSession):
+    state = await start_week(name)
+    schedule = {"interval": POLL_INTERVAL, "failures": 0}
+
+    while True:
+        stats = new_fetch_stats()
+        try:
+            await poll_collection(name, state, session, stats)
+        except Exception as e:
+            print(f"[{name}] Error in polling loop: {str(e)}")
+            stats["errors"] += 1
+
+        await asyncio.sleep(next_poll_interval(name, schedule, stats))
+
+
+async def batched_poll_task(session: aiohttp.ClientSession):
+    names = list(COLLECTIONS)
+    states = {name: await start_week(name) for name in names}
+    schedule = {"interval": POLL_INTERVAL, "failures": 0}
+
+    while True:
+        stats = new_fetch_stats()
+        first_pages = await fetch_first_pages(names, session, stats, POLL_PAGE_SIZE)
+        # A failed batch is retried per collection right away, so only count
+        # it against the schedule if those fallbacks fail too.
+        stats["errors"] = 0
+
+        collection_stats = {name: new_fetch_stats() for name in names}
+        results = await asyncio.gather(
+            *(poll_collection(name, states[name], session, collection_stats[name], first_pages[name]) for name in names),
+            return_exceptions=True
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                print(f"[{name}] Error in polling loop: {str(result)}")
+                collection_stats[name]["errors"] += 1
+            for field, value in collection_stats[name].items():
+                stats[field] += value
+
+        await asyncio.sleep(next_poll_interval("batch", schedule, stats))
+
+
+async def background_task():
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if BATCH_POLLING:
+            await batched_poll_task(session)
+        else:
+            await asyncio.gather(*(collection_task(name, session) for name in COLLECTIONS))
+
+
+app = FastAPI()
+
+
+def find_latest_csv(directory: str, prefix: str) -> str:
+    try:
+        files = os.listdir(directory)
+        matching_files = [f for f in files if f.startswith(prefix) and f.endswith(".csv")]
+        if not matching_files:
+            return None
+        latest_file = max(
+            matching_files,
+            key=lambda x: int(x.split("_")[-1].replace(".csv", ""))
+        )
+        return os.path.join(directory, latest_file)
+    except Exception as e:
+        print(f"Error finding latest CSV: {e}")
+        return None
+
+
+def _serve_csv(filename: str, live: bool = False, request_headers=None, immutable: bool = False, view=None) -> Response:
+    # Small files come from the response cache, bigger ones are streamed from
+    # disk a chunk at a time; either way an unchanged file is a 304.
+    try:
+        segment_filename = segments.segment_filename(filename)
+        if live:
+            view_filename, snapshot = view
+            if snapshot is not None:
+                write_sorted_view(view_filename, snapshot)
+            return streaming.file_response(view_filename, request_headers, download_name=os.path.basename(filename))
+        if not os.path.exists(filename) and os.path.exists(segment_filename):
+            etag, last_modified = streaming.file_validators(os.stat(segment_filename))
+            headers = streaming.cache_headers(etag, last_modified, immutable)
+            if streaming.not_modified(request_headers, etag, last_modified):
+                return Response(status_code=304, headers=headers)
+            headers['Content-Disposition'] = f'attachment; filename={os.path.basename(filename)}'
+            return StreamingResponse(open_segment(segment_filename).iter_csv(), media_type="text/csv", headers=headers)
+        return streaming.file_response(filename, request_headers, immutable=immutable)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+
+
+async def serve_csv(filename: str, live: bool = False, request_headers=None, immutable: bool = False) -> Response:
+    if live:
+        # The live log is being appended to; only reading its index waits
+        # for the write in progress.
+        try:
+            async with file_lock(filename):
+                view = await run_io(snapshot_sorted_view, filename)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+        return await run_io(_serve_csv, filename, live, request_headers, False, view)
+    return await run_io(_serve_csv, filename, live, request_headers, immutable)
+
+
+def is_closed_week(name: str, week_start: int):
+    # Segments are written once a week is final, so their presence is what
+    # makes a week's URL safe to cache forever.
+    current_ts, _ = get_week_timestamps()
+    return week_start < current_ts and os.path.exists(f"./{name}_buyers/{name}_buyers_{week_start}.seg")
+
+
+def db_csv_rows(name: str, rows):
+    by_order = COLLECTIONS[name]["dedup"] == "orderId"
+    csv_rows = []
+    for buyer, asset_id, quantity, price, tx_hash, timestamp, real_price, token, purchase_key in rows:
+        if by_order:
+            # Sales imported from a log without orderId are keyed on their txHash.
+            order_id = "" if purchase_key == tx_hash else purchase_key
+            csv_rows.append([buyer, f"{asset_id} {quantity}x", price, tx_hash, timestamp, real_price, token, order_id])
+        else:
+            csv_rows.append([buyer, asset_id, price, tx_hash, timestamp, real_price, token])
+    return csv_rows
+
+
+def db_week_csv_rows(name: str, week_start: int):
+    return db_csv_rows(name, sales_db.week_rows(DB, name, week_start, week_start + 7 * 24 * 60 * 60))
+
+
+STREAM_CHUNK_ROWS = 1000
+
+
+async def _serve_db_week(name: str, week_start: int, request_headers=None, immutable: bool = False) -> Response:
+    week_end = week_start + 7 * 24 * 60 * 60
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    current_ts, _ = get_week_timestamps()
+    count, newest_rowid = sales_db.week_version(DB, name, week_start, week_end)
+    if not count and week_start != current_ts:
+        # Weeks closed before the switch to the database are still files.
+        if os.path.exists(filename) or os.path.exists(segments.segment_filename(filename)):
+            return await serve_csv(filename, request_headers=request_headers, immutable=immutable)
+        raise HTTPException(status_code=404, detail="No buyers data found")
+
+    headers = streaming.cache_headers(f'"db-{count:x}-{newest_rowid:x}"', immutable=immutable)
+    if streaming.not_modified(request_headers, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    headers['Content-Disposition'] = f'attachment; filename={os.path.basename(filename)}'
+    cursor = sales_db.week_rows(DB, name, week_start, week_end)
+    rows = cursor.fetchmany(STREAM_CHUNK_ROWS)
+
+    async def body(rows):
+        # Fetched a chunk at a time on the loop thread, which owns the
+        # connection, handing control back between chunks.
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(get_fieldnames(name))
+        try:
+            while True:
+                writer.writerows(db_csv_rows(name, rows))
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                rows = cursor.fetchmany(STREAM_CHUNK_ROWS)
+                if not rows:
+                    break
+        finally:
+            cursor.close()
+
+    return StreamingResponse(body(rows), media_type="text/csv", headers=headers)
+
+
+_log_indexes = {}
+
+
+def parse_cursor(since: str):
+    """(timestamp, None) for a numeric cursor, (None, txHash) otherwise."""
+    if since.isdigit():
+        return int(since), None
+    return None, since
+
+
+def open_week_index(name: str, week_start: int):
+    """A week kept as files, searchable: its Segment once closed, else its log's LogIndex."""
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    segment_filename = segments.segment_filename(filename)
+    if os.path.exists(segment_filename):
+        # A closed log's index is not needed any more.
+        _log_indexes.pop(filename, None)
+        return open_segment(segment_filename)
+    if not os.path.exists(filename):
+        return None
+    return get_log_index(filename)
+
+
+def get_log_index(filename: str):
+    """The live log's LogIndex, refreshed; callers hold the log's lock."""
+    if filename not in _log_indexes:
+        _log_indexes[filename] = log_index.LogIndex(filename)
+    _log_indexes[filename].refresh()
+    return _log_indexes[filename]
+
+
+def file_delta(name: str, week_start: int, since: int = None, tx_hash: str = None):
+    """(header, rows) of a week kept as files, newer than the cursor, newest first."""
+    source = open_week_index(name, week_start)
+    if source is None:
+        return None, None
+    if isinstance(source, segments.Segment):
+        return source.footer["header"], source.rows_at(source.after(since, tx_hash))
+    return source.header, source.read_rows(source.after(since, tx_hash))
+
+
+def delta_response(header: list, rows: list, since: str, response_format: str) -> Response:
+    # The next cursor is the txHash of the newest row; the last row of a tie
+    # on the newest timestamp, which is where a txHash cursor resumes.
+    columns = {column: i for i, column in enumerate(header)}
+    cursor = since
+    for row in rows:
+        if str(row[columns["timestamp"]]) != str(rows[0][columns["timestamp"]]):
+            break
+        cursor = row[columns["txHash"]]
+
+    headers = {'X-Cursor': cursor, 'Cache-Control': streaming.REVALIDATE}
+    if response_format == "ndjson":
+        lines = []
+        for row in rows:
+            record = dict(zip(header, row))
+            record["timestamp"] = int(record["timestamp"])
+            lines.append(json.dumps(record))
+        body = "".join(line + "\n" for line in lines)
+        return Response(content=body, media_type="application/x-ndjson", headers=headers)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return Response(content=buffer.getvalue(), media_type="text/csv", headers=headers)
+
+
+async def serve_delta(name: str, week_start: int, since: str, response_format: str) -> Response:
+    """Only the sales newer than a client's cursor: a timestamp or a txHash.
+
+    Every store is time ordered (segments and the database by construction,
+    live logs through a LogIndex), so the cursor is found by binary search
+    and the work done is proportional to the rows returned.
+    """
+    if response_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    cursor_timestamp, tx_hash = parse_cursor(since)
+    if DB is not None:
+        week_end = week_start + 7 * 24 * 60 * 60
+        count, _ = sales_db.week_version(DB, name, week_start, week_end)
+        current_ts, _ = get_week_timestamps()
+        # Weeks closed before the switch to the database are still files.
+        if count or week_start == current_ts:
+            cursor = sales_db.rows_after(DB, name, week_start, week_end, cursor_timestamp, tx_hash)
+            try:
+                rows = db_csv_rows(name, cursor.fetchall())
+            finally:
+                cursor.close()
+            return delta_response(get_fieldnames(name), rows, since, response_format)
+
+    filename = f"./{name}_buyers/{name}_buyers_{week_start}.csv"
+    try:
+        # The lock keeps the index from reading a page that is half appended.
+        async with file_lock(filename):
+            header, rows = await run_io(file_delta, name, week_start, cursor_timestamp, tx_hash)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+    if header is None:
+        raise HTTPException(status_code=404, detail="No buyers data found")
+    return delta_response(header, rows, since, response_format)
+
+
+def register_buyers_routes(name: str):
+    async def get_buyers_with_timestamp(timestamp: int, request: Request, since: str = None, format: str = "csv"):
+        if since is not None:
+            return await serve_delta(name, timestamp, since, format)
+        immutable = is_closed_week(name, timestamp)
+        if DB is not None:
+            return await _serve_db_week(name, timestamp, request.headers, immutable)
+        filename = f"./{name}_buyers/{name}_buyers_{timestamp}.csv"
+        current_ts, _ = get_week_timestamps()
+        return await serve_csv(filename, live=timestamp == current_ts, request_headers=request.headers, immutable=immutable)
+
+    async def get_current_buyers(request: Request, since: str = None, format: str = "csv"):
+        current_ts, _ = get_week_timestamps()
+        if since is not None:
+            return await serve_delta(name, current_ts, since, format)
+        current_filename = f"./{name}_buyers/{name}_buyers_{current_ts}.csv"
+
+        if DB is not None:
+            return await _serve_db_week(name, current_ts, request.headers)
+        if os.path.exists(current_filename):
+            return await serve_csv(current_filename, live=True, request_headers=request.headers)
+        else:
+            latest_week = MANIFEST.latest(name)
+            if latest_week is not None:
+                latest_file = f"./{name}_buyers/{name}_buyers_{latest_week}.csv"
+            else:
+                latest_file = await run_io(find_latest_csv, f"./{name}_buyers", f"{name}_buyers_")
+            if latest_file:
+                return await serve_csv(latest_file, request_headers=request.headers)
+            else:
+                raise HTTPException(status_code=404, detail="No buyers data found")
+
+    async def get_week_summary(timestamp: int):
+        segment_filename = f"./{name}_buyers/{name}_buyers_{timestamp}.seg"
+        if not os.path.exists(segment_filename):
+            raise HTTPException(status_code=404, detail="No closed week found")
+        footer = (await run_io(open_segment, segment_filename)).footer
+        return {field: footer[field] for field in ("rows", "min_timestamp", "max_timestamp", "buyers", "tokens")}
+
+    app.add_api_route(f"/{name}_buyers/{{timestamp}}", get_buyers_with_timestamp, methods=["GET"])
+    app.add_api_route(f"/{name}_buyers/{{timestamp}}/summary", get_week_summary, methods=["GET"])
+    app.add_api_route(f"/{name}_buyers/", get_current_buyers, methods=["GET"])
+
+
+for collection_name in COLLECTIONS:
+    register_buyers_routes(collection_name)
+
+
+@app.get("/sales")
+async def get_sales(
+    collection: str = None,
+    buyer: str = None,
+    asset_id: str = None,
+    token: str = None,
+    start: int = None,
+    end: int = None,
+    min_price: str = None,
+    fields: str = None,
+    limit: int = sales_query.DEFAULT_LIMIT,
+    cursor: str = None,
+    format: str = "json"
+):
+    """Sales matching the filters, newest first, a page at a time.
+
+    collection may list several, comma separated; start/end bound the
+    timestamp as [start, end); min_price is in display units of each sale's
+    token. Pass back next_cursor (X-Next-Cursor for ndjson) for the next page.
+    """
+    collections = collection.split(",") if collection else list(COLLECTIONS)
+    if any(name not in COLLECTIONS for name in collections):
+        raise HTTPException(status_code=400, detail="Unknown collection")
+    if token is not None and token not in TOKEN_DECIMALS:
+        raise HTTPException(status_code=400, detail="Unknown token")
+    if not 1 <= limit <= sales_query.MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {sales_query.MAX_LIMIT}")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    selected = fields.split(",") if fields else list(sales_query.RECORD_FIELDS)
+    if any(field not in sales_query.RECORD_FIELDS for field in selected):
+        raise HTTPException(status_code=400, detail=f"fields must be among {', '.join(sales_query.RECORD_FIELDS)}")
+    # Addresses are matched by their lowercase form, as in /buyers.
+    filters = {"buyer": buyer and buyer.lower(), "asset_id": asset_id, "token": token, "start": start, "end": end}
+    if min_price is not None:
+        try:
+            filters["min_units"] = sales_query.min_units(min_price, TOKEN_DECIMALS)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        after = sales_query.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if DB is not None:
+        matches = sales_db.query_sales(DB, sorted(collections), filters, after, limit + 1)
+        records = [
+            sales_query.record(name, get_fieldnames(name), db_csv_rows(name, [row])[0])
+            for _, name, _, row in matches[:limit]
+        ]
+        next_key = list(matches[limit - 1][:3]) if len(matches) > limit else None
+    else:
+        weeks = {name: list(MANIFEST.weeks(name)) for name in collections}
+        # The live logs are being appended to; wait for any write in progress.
+        async with contextlib.AsyncExitStack() as stack:
+            for name in collections:
+                await stack.enter_async_context(file_lock(get_current_filename(name)))
+            records, next_key = await run_io(sales_query.query_files, weeks, open_week_index, filters, after, limit)
+
+    records = [{field: values.get(field) for field in selected} for values in records]
+    next_cursor = sales_query.encode_cursor(next_key) if next_key else None
+    if format == "ndjson":
+        body = "".join(json.dumps(values) + "\n" for values in records)
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return Response(content=body, media_type="application/x-ndjson", headers=headers)
+    return {"sales": records, "next_cursor": next_cursor}
+
+
+def buyer_purchases(buyer: str):
+    """(collection, CSV header, row) for every purchase of a buyer, newest first."""
+    if DB is not None:
+        return [(name, get_fieldnames(name), db_csv_rows(name, [row])[0]) for name, row in sales_db.buyer_rows(DB, buyer)]
+
+    closed, live, _ = BUYERS.lookup(buyer)
+    purchases = []
+    for (name, week_start), rows in closed.items():
+        segment = open_segment(f"./{name}_buyers/{name}_buyers_{week_start}.seg")
+        header = segment.footer["header"]
+        purchases += [(name, header, row) for row in segment.rows_at(rows)]
+    for name, index, rows in live:
+        purchases += [(name, index.header, row) for row in index.read_rows(rows)]
+    purchases.sort(key=lambda purchase: -int(purchase[2][4]))
+    return purchases
+
+
+@app.get("/buyers/{address}")
+async def get_buyer_profile(address: str, start: int = None, end: int = None, purchases: bool = True):
+    """A buyer's purchases across every collection and week, with per-token totals.
+
+    start/end restrict both to [start, end); purchases=false returns only the
+    totals, which without a range come straight from the index.
+    """
+    buyer = address.lower()
+    if DB is None and not purchases and start is None and end is None:
+        _, _, totals = BUYERS.lookup(buyer)
+        sales = None
+    else:
+        if DB is not None:
+            # On the loop thread, which owns the connection.
+            found = buyer_purchases(buyer)
+        else:
+            # The live logs are being appended to; wait for any write in progress.
+            async with contextlib.AsyncExitStack() as stack:
+                for name in COLLECTIONS:
+                    await stack.enter_async_context(file_lock(get_current_filename(name)))
+                found = await run_io(buyer_purchases, buyer)
+        records = [
+            sales_query.record(name, header, row)
+            for name, header, row in found
+            if (start is None or int(row[4]) >= start) and (end is None or int(row[4]) < end)
+        ]
+        totals = {}
+        for values in records:
+            values["realPrice"] = str(values["realPrice"])
+            tokens = totals.setdefault(values["collection"], {})
+            tokens[values["token"]] = tokens.get(values["token"], 0) + int(values["realPrice"])
+        sales = records if purchases else None
+
+    profile = {
+        "buyer": buyer,
+        "totals": {
+            name: {token: str(units) for token, units in tokens.items()}
+            for name, tokens in totals.items()
+        }
+    }
+    if sales is not None:
+        profile["purchases"] = sales
+    return profile
+
+
+@app.get("/aggregate")
+async def get_aggregate(collection: str, start: int, end: int, by_buyer: bool = False):
+    """Sales, volume and unique buyers of a collection over any [start, end).
+
+    Whole weeks and whole hours come from precomputed rollups; only the rows
+    in the partial first and last hour are read. by_buyer adds each buyer's
+    per-token totals, as in the unique CSVs.
+    """
+    if collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail="Unknown collection")
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    weeks = week_starts_between(start, end)
+    rollup_for = functools.partial(week_rollup, collection)
+    scan = functools.partial(scan_week, collection)
+    if DB is not None:
+        # Segments are rolled up off the loop; weeks still in the database,
+        # and the edge hours read from it, stay on the loop thread, which
+        # owns the connection.
+        built = await run_io(segment_rollups, collection, weeks)
+
+        def rollup_for(week_start):
+            return built[week_start] if week_start in built else week_rollup(collection, week_start)
+
+        result = rollups.aggregate(weeks, start, end, rollup_for, scan, by_buyer)
+    else:
+        # The live log may be scanned for an edge hour; wait for any write in progress.
+        async with file_lock(get_current_filename(collection)):
+            result = await run_io(rollups.aggregate, weeks, start, end, rollup_for, scan, by_buyer)
+
+    response = {
+        "collection": collection,
+        "start": start,
+        "end": end,
+        "sales": result["sales"],
+        "buyers": len(result["buyers"]),
+        "volume": {token: str(units) for token, units in result["volume"].items()}
+    }
+    if by_buyer:
+        response["by_buyer"] = {
+            buyer: {token: str(units) for token, units in tokens.items()}
+            for buyer, tokens in sorted(result["buyers"].items(), key=lambda item: item[0].lower())
+        }
+    return response
+
+
+@app.get("/weeks")
+async def get_weeks():
+    # Straight from the in-memory manifest; volumes are integer base units.
+    return {
+        name: {
+            week_start: {
+                "rows": week["rows"],
+                "volume": {token: str(units) for token, units in week["volume"].items()},
+                "closed": week["closed"]
+            }
+            for week_start, week in MANIFEST.weeks(name).items()
+        }
+        for name in COLLECTIONS
+    }
+
+
+@app.get("/api_usage")
+async def get_api_usage():
+    return KEY_POOL.snapshot()
+
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(background_task())
+
+
+if __name__ == "__main__":
+    # Each collection used to be served by a process of its own, on the port
+    # in its entry. One server listens on all of them, so URLs such as
+    # :8002/packs_buyers/ keep working, while the app and its polling run once.
+    listeners = []
+    for port in sorted({8000, *(collection["port"] for collection in COLLECTIONS.values())}):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("0.0.0.0", port))
+        listeners.append(listener)
+    uvicorn.Server(uvicorn.Config("tracker:app", reload=False)).run(sockets=listeners)